@@ -1,42 +1,144 @@
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+from series import CompactSeries, time_ns, value_array, sensor_codes, data_time_ns, data_values, data_sensor_codes, grouped
+from policies import HourlyRateEstimator
+from profiling import profiled
+from stats import ErrorStats
 
-def error(df, df_original, column_name):
+# Number of original points compared at once by error_chunks
+CHUNK_SIZE = 1 << 20
+
+def error_chunks(df, df_original, column_name, by=None, chunksize=CHUNK_SIZE):
     """
-    Calculate the error between the values in a column of a DataFrame and the last value before each timestamp.
+    Calculate the error between the values in a column of a DataFrame and the last value before each timestamp,
+    yielding the errors of `chunksize` original points at a time.
+
+    The last sampled value at or before each original timestamp is found with a single sorted lookup,
+    so the cost is O(N log M) for N original points and M sampled points, and the memory beyond the
+    input columns is O(M + chunksize): the columns of a CompactSeries are only widened a chunk at a time.
 
     Args:
         df (pandas.DataFrame): The DataFrame containing the values.
         df_original (pandas.DataFrame): The original DataFrame containing the timestamps and values.
         column_name (str): The name of the column to calculate the error for.
+        by (str, optional): The column identifying the sensor of each row. When given, each original point
+            is compared with the last sample of the same sensor.
+        chunksize (int): The number of original points of each chunk. Defaults to CHUNK_SIZE.
 
-    Returns:
-        list: A list of absolute differences between the values in the specified column and the last value before each timestamp.
+    Yields:
+        numpy.ndarray: The absolute differences of the points of a chunk, as described in error.
 
     Raises:
         ValueError: If the specified column does not exist in the DataFrame.
     """
     
-    diff = []
     # Check if the column exists in the DataFrame
-    if column_name not in df.columns:
+    if not isinstance(df, CompactSeries) and column_name not in df.columns:
         raise ValueError(f"The column '{column_name}' does not exist in the DataFrame.")
 
-    def last_value_before(timestamp):
-        if df[df['time'] <= timestamp].empty:
-            raise ValueError("No point before the date")
-        return df[df['time'] <= timestamp].iloc[-1]
-    
-    for i in range(1, len(df_original)):
-        try:
-            diff.append(abs(df_original["value"].iloc[i] - last_value_before(df_original["time"].iloc[i])["value"]))
-        except ValueError:
-                    continue
+    sampled_keys = data_time_ns(df)
+    sampled_values = data_values(df)
+
+    per_sensor = grouped(df_original, by)
+    if per_sensor:
+        if isinstance(df_original, CompactSeries):
+            categories = df_original.categories
+        else:
+            categories = sensor_codes(df_original[by])[1]
+        sampled_codes = data_sensor_codes(df, by, categories)[0]
+        # Whether the first original point of each sensor, never compared, was seen. The last entry is for the code -1
+        seen = np.zeros(len(categories) + 1, dtype=bool)
+
+        # Sort by sensor then time with a single key: the sensor offset by the rank of the timestamp among the sampled ones.
+        # A sampled point gets its rank + 1 and an original point the number of sampled timestamps at or before it,
+        # so that it comes after the samples of the same sensor taken at or before it.
+        known = sampled_codes >= 0
+        sampled_codes, sampled_keys, sampled_values = sampled_codes[known], sampled_keys[known], sampled_values[known]
+        ranks = np.unique(sampled_keys)
+        span = len(ranks) + 1
+        sampled_keys = sampled_codes.astype(np.int64) * span + np.searchsorted(ranks, sampled_keys) + 1
+
+    if len(sampled_keys) > 1 and np.any(sampled_keys[1:] < sampled_keys[:-1]):
+        order = np.argsort(sampled_keys, kind="stable")
+        sampled_keys = sampled_keys[order]
+        sampled_values = sampled_values[order]
+        if per_sensor:
+            sampled_codes = sampled_codes[order]
+
+    for start in range(0, len(df_original), chunksize):
+        if isinstance(df_original, CompactSeries):
+            chunk = df_original.rows(start, start + chunksize)
+        else:
+            chunk = df_original.iloc[start:start + chunksize]
+        chunk_keys, chunk_values = data_time_ns(chunk), data_values(chunk)
+        kept = np.ones(len(chunk_keys), dtype=bool)
+        if per_sensor:
+            chunk_codes = data_sensor_codes(chunk, by, categories)[0]
+            present, first = np.unique(chunk_codes, return_index=True)
+            kept[first[~seen[present]]] = False
+            seen[present] = True
+            kept &= chunk_codes >= 0
+        elif start == 0:
+            # The first original point is never compared
+            kept[0] = False
+        chunk_keys, chunk_values = chunk_keys[kept], chunk_values[kept]
+        if per_sensor:
+            chunk_codes = chunk_codes[kept]
+            chunk_keys = chunk_codes.astype(np.int64) * span + np.searchsorted(ranks, chunk_keys, side="right")
+
+        # Position of the last sample at or before each original timestamp, -1 if there is none
+        positions = np.searchsorted(sampled_keys, chunk_keys, side="right") - 1
+        found = positions >= 0
+        if per_sensor:
+            # The last sample before the point may belong to the previous sensor
+            found[found] = sampled_codes[positions[found]] == chunk_codes[found]
+
+        yield np.abs(chunk_values[found] - sampled_values[positions[found]])
+
+@profiled()
+def error(df, df_original, column_name, by=None):
+    """
+    Calculate the error between the values in a column of a DataFrame and the last value before each timestamp.
+
+    Args:
+        df (pandas.DataFrame): The DataFrame containing the values.
+        df_original (pandas.DataFrame): The original DataFrame containing the timestamps and values.
+        column_name (str): The name of the column to calculate the error for.
+        by (str, optional): The column identifying the sensor of each row. When given, each original point
+            is compared with the last sample of the same sensor.
+
+    Returns:
+        numpy.ndarray: The absolute differences between the values in the specified column and the last value before each timestamp.
+        Points of `df_original` that come before the first sample of `df` are skipped.
+        The first point of `df_original`, or of each sensor with `by`, is never compared.
 
-    return diff
+    Raises:
+        ValueError: If the specified column does not exist in the DataFrame.
+    """
+    chunks = list(error_chunks(df, df_original, column_name, by, chunksize=max(len(df_original), 1)))
+    return np.concatenate(chunks) if chunks else np.empty(0)
 
+@profiled()
+def error_stats(df, df_original, column_name, by=None, chunksize=CHUNK_SIZE, compression=1000):
+    """
+    Summarize the errors computed by error in a single pass, without holding all of them in memory.
 
+    Args:
+        df, df_original, column_name, by: See error.
+        chunksize (int): The number of original points compared at once. Defaults to CHUNK_SIZE.
+        compression (float): The compression of the quantile estimates, see ErrorStats. Defaults to 1000.
 
+    Returns:
+        ErrorStats: The count, mean, variance, max and approximate quantiles of the errors.
+    """
+    stats = ErrorStats(compression)
+    for chunk in error_chunks(df, df_original, column_name, by, chunksize):
+        stats.update(chunk)
+    return stats
+
+
+
+@profiled()
 def plot_histogram(data_series, bins=10, title="Distribution of Absolute Differences"):
     """
     Plots a histogram of the given data series.
@@ -59,17 +161,33 @@ def plot_histogram(data_series, bins=10, title="Distribution of Absolute Differe
     plt.grid(True)
     plt.show()
 
-def compute_efficiency(df):
+@profiled()
+def compute_efficiency(df, by=None):
     """
     Compute the efficiency of a data frame. i.e the time taken to collect each data point.
 
     Parameters:
     df (pandas.DataFrame): The input data frame.
+    by (str, optional): The column identifying the sensor of each row. When given, the efficiency of each sensor is computed.
 
     Returns:
-    float: The efficiency value.
+    float: The efficiency value, or a pandas.Series of efficiency values indexed by sensor with `by`.
 
     """
+    if isinstance(df, CompactSeries):
+        sizes = np.diff(df.starts)
+        present = np.flatnonzero(sizes)
+        first = df.offsets[df.starts[:-1][present]].astype(np.int64)
+        last = df.offsets[df.starts[1:][present] - 1].astype(np.int64)
+        efficiency = (last - first) / sizes[present]
+        if df.categories is None:
+            return float(efficiency[0])
+        return pd.Series(efficiency, index=df.categories[present])
+
+    if by is not None:
+        times = df.groupby(by, observed=True)["time"].agg(["first", "last", "size"])
+        return (times["last"] - times["first"]).dt.total_seconds() / times["size"]
+
     # compute the time difference between the first and last point
     time_diff = df["time"].iloc[-1] - df["time"].iloc[0]
     # compute the number of points
@@ -78,15 +196,19 @@ def compute_efficiency(df):
     efficiency = time_diff.total_seconds() / num_points
     return efficiency
 
-def hourly_rate_of_change(df):
+@profiled()
+def hourly_rate_of_change(df, by=None):
     """
     Calculate the average absolute rate of change per hour for a given DataFrame.
 
     Args:
         df (pandas.DataFrame): The DataFrame containing the data.
+        by (str, optional): The column identifying the sensor of each row. When given, the rate of change
+            is computed between consecutive readings of the same sensor.
 
     Returns:
         pandas.Series: A Series containing the average absolute rate of change per hour.
+        With `by`, a pandas.DataFrame with one row per sensor and one column per hour of the day.
 
     Raises:
         ValueError: If the DataFrame does not include 'time' and 'value' columns, or if it is empty.
@@ -106,17 +228,47 @@ def hourly_rate_of_change(df):
     if not pd.api.types.is_datetime64_any_dtype(df['time']):
         raise ValueError("'time' column must be of datetime type.")
 
-    # Calculate the difference between consecutive entries
-    df['time_diff'] = df['time'].diff().dt.total_seconds() / 3600  # Convert time difference to hours
-    df['value_diff'] = df['value'].diff()
+    # Calculate the difference between consecutive entries, without touching the caller's frame
+    consecutive = df if by is None else df.groupby(by, observed=True, sort=False)
+    time_diff = consecutive['time'].diff().dt.total_seconds() / 3600  # Convert time difference to hours
+    value_diff = consecutive['value'].diff()
 
     # Calculate the rate of change in degrees per hour, and take the absolute value
-    df['rate_of_change'] = (df['value_diff'] / df['time_diff']).abs()
-
-    # Extract the hour from each datetime
-    df['hour'] = df['time'].dt.hour
+    rates = pd.DataFrame({
+        'rate_of_change': (value_diff / time_diff).abs(),
+        # Extract the hour from each datetime
+        'hour': df['time'].dt.hour,
+    })
 
     # Group by hour and calculate the average absolute rate of change for each hour
-    hourly_avg_abs_rate = df.groupby('hour')['rate_of_change'].mean()
+    if by is not None:
+        rates[by] = df[by]
+        rates = rates.groupby([by, 'hour'], observed=True)['rate_of_change'].mean()
+        return rates.unstack('hour').reindex(columns=range(24))
+    hourly_avg_abs_rate = rates.groupby('hour')['rate_of_change'].mean()
 
     return hourly_avg_abs_rate
+
+def fit_hourly_rates(df, decay=0.0):
+    """
+    Build an incremental hourly rate of change estimator from historical data.
+
+    Parameters:
+        df (pandas.DataFrame): The DataFrame containing the 'time' and 'value' columns of a single sensor, sorted by time.
+        decay (float): The decay of the estimator, see HourlyRateEstimator. Defaults to 0, a plain mean.
+
+    Returns:
+        HourlyRateEstimator: The estimator, ready to be updated with live readings or saved.
+    """
+    estimator = HourlyRateEstimator(decay)
+    if df.empty:
+        return estimator
+    times = time_ns(df['time'])
+    values = value_array(df['value'])
+    hours = df['time'].dt.hour.to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rates = np.abs(np.diff(values) / (np.diff(times) / 3.6e12))
+    for hour, rate in zip(hours[1:].tolist(), rates.tolist()):
+        estimator.add_rate(hour, rate)
+    estimator.last = (df['time'].iloc[-1], float(values[-1]))
+    return estimator
@@ -0,0 +1,177 @@
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from analyze import error, error_stats, hourly_rate_of_change
+from generate_data import generate_greenhouse_data, generate_simplex
+from poll import sample_every_kth_point, sample_reglin, optimal_sample, sample_avg_rate_of_change, sample_policy
+from policies import RegLinPolicy
+
+START = datetime.datetime(2024, 1, 1)
+
+def synthetic_data(n, seed=0):
+    """
+    Generate a deterministic trace of n points, one per minute.
+
+    Parameters:
+    - n (int): The number of points.
+    - seed (int): The seed of the Simplex noise. Defaults to 0.
+
+    Returns:
+    - pandas.DataFrame: The 'time' and 'value' columns of the trace.
+    """
+    return generate_simplex(START, START + datetime.timedelta(minutes=n - 1), interval=60, frequency=100, seed=seed)
+
+def benchmarks(n, workdir):
+    """
+    Build the benchmarks run at size n.
+
+    Parameters:
+    - n (int): The number of points of the synthetic data.
+    - workdir (str): A directory for the files read by the ingestion benchmarks.
+
+    Returns:
+    - dict: A function without arguments for each benchmark name.
+    """
+    df = synthetic_data(n)
+    sampled = sample_every_kth_point(df, 10)
+    poll_rate = 3600 * 0.5 / hourly_rate_of_change(df)
+
+    csv = os.path.join(workdir, f"greenhouse-{n}.csv")
+    if not os.path.exists(csv):
+        df.assign(id="0")[["id", "time", "value"]].to_csv(csv, index=False)
+    cache_dir = os.path.join(workdir, ".cache")
+    generate_greenhouse_data(csv, cache_dir=cache_dir)
+
+    return {
+        "error": lambda: error(sampled, df, 'value'),
+        "error_stats": lambda: error_stats(sampled, df, 'value'),
+        "sample_every_kth_point": lambda: sample_every_kth_point(df, 10),
+        "sample_reglin": lambda: sample_reglin(df, max_dT=0.5),
+        "optimal_sample": lambda: optimal_sample(df, threshold_dT=0.5),
+        "sample_avg_rate_of_change": lambda: sample_avg_rate_of_change(df, poll_rate),
+        "sample_policy_reglin": lambda: sample_policy(df, lambda sensor: RegLinPolicy(0.5)),
+        "generate_greenhouse_data": lambda: generate_greenhouse_data(csv, cache_dir=False),
+        "generate_greenhouse_data_cached": lambda: generate_greenhouse_data(csv, cache_dir=cache_dir),
+        "generate_simplex": lambda: synthetic_data(n),
+    }
+
+def measure(function, repeat=3):
+    """
+    Measure the best wall time of a function over `repeat` runs, and its peak traced memory in a separate run.
+
+    Returns:
+    - tuple: The best time in seconds and the peak memory in bytes.
+    """
+    function()  # Warm up caches and compiled kernels
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+def scaling(results):
+    """
+    Fit the exponent k of time ~ n ** k for each benchmark, over the sizes it ran at.
+
+    Parameters:
+    - results (list): The result records of a single run.
+
+    Returns:
+    - dict: The exponent of each benchmark.
+    """
+    exponents = {}
+    for name in sorted({r["benchmark"] for r in results}):
+        points = [(r["n"], r["seconds"]) for r in results if r["benchmark"] == name and r["seconds"] > 0]
+        if len(points) >= 2:
+            x, y = np.log([p[0] for p in points]), np.log([p[1] for p in points])
+            exponents[name] = float(np.polyfit(x, y, 1)[0])
+    return exponents
+
+def commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(sizes, names=None, repeat=3, output="benchmarks.jsonl"):
+    """
+    Run the benchmarks at each size, print a report and append the results to a JSON lines file.
+
+    Parameters:
+    - sizes (list): The numbers of points to run at.
+    - names (list, optional): The benchmarks to run. Defaults to all of them.
+    - repeat (int): The number of timed runs of each benchmark. Defaults to 3.
+    - output (str, optional): The JSON lines file the results are appended to, one record per benchmark and size.
+
+    Returns:
+    - list: The result records.
+    """
+    results = []
+    run_info = {"commit": commit(), "date": datetime.datetime.now().isoformat(timespec="seconds"), "python": platform.python_version()}
+    print(f"{'benchmark':<34}{'n':>10}{'seconds':>12}{'points/s':>14}{'peak MB':>10}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for n in sizes:
+            for name, function in benchmarks(n, workdir).items():
+                if names and name not in names:
+                    continue
+                seconds, peak = measure(function, repeat)
+                record = dict(run_info, benchmark=name, n=n, seconds=seconds, throughput=n / seconds if seconds else None, peak_bytes=peak)
+                results.append(record)
+                print(f"{name:<34}{n:>10}{seconds:>12.5f}{n / seconds if seconds else math.inf:>14.0f}{peak / 2 ** 20:>10.1f}")
+
+    print("\nScaling exponent (time ~ n^k)")
+    for name, k in scaling(results).items():
+        print(f"{name:<34}{k:>6.2f}")
+
+    if output:
+        with open(output, "a") as f:
+            for record in results:
+                f.write(json.dumps(record) + "\n")
+    return results
+
+def compare(path, base, head):
+    """
+    Print the time ratio of each benchmark and size between two commits recorded in a results file.
+
+    Parameters:
+    - path (str): The JSON lines results file.
+    - base (str): The reference commit.
+    - head (str): The compared commit.
+    """
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    # The latest record of each commit, benchmark and size wins
+    latest = {(r["commit"], r["benchmark"], r["n"]): r for r in records}
+    print(f"{'benchmark':<34}{'n':>10}{base:>12}{head:>12}{'ratio':>8}")
+    for (c, name, n), r in sorted(latest.items(), key=lambda item: (item[0][1], item[0][2])):
+        if c != head or (base, name, n) not in latest:
+            continue
+        before = latest[(base, name, n)]["seconds"]
+        print(f"{name:<34}{n:>10}{before:>12.5f}{r['seconds']:>12.5f}{r['seconds'] / before:>8.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the samplers, the error computation and the data generation.")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1e3, 1e4, 1e5, 1e6], help="numbers of points, up to 1e7")
+    parser.add_argument("--benchmarks", nargs="+", help="benchmarks to run, all by default")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs of each benchmark")
+    parser.add_argument("--output", default="benchmarks.jsonl", help="JSON lines file the results are appended to")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "HEAD"), help="compare two commits of the output file instead of running")
+    args = parser.parse_args()
+    if args.compare:
+        compare(args.output, *args.compare)
+    else:
+        run([int(n) for n in args.sizes], args.benchmarks, args.repeat, args.output)
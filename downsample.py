@@ -0,0 +1,75 @@
+import numpy as np
+
+def _buckets(n, count):
+    # Start of each of `count` buckets of nearly equal size over n points
+    return np.unique(np.arange(count, dtype=np.int64) * n // count)
+
+def minmax(x, y, buckets):
+    """
+    Downsample a line to the first, lowest, highest and last point of each of `buckets` buckets of consecutive points.
+
+    Drawn with one bucket per pixel column, the line covers the same pixels as the full line, so peaks are never lost.
+
+    Parameters:
+    - x (numpy.ndarray): The sorted x coordinates, for instance int64 times.
+    - y (numpy.ndarray): The y coordinates.
+    - buckets (int): The number of buckets.
+
+    Returns:
+    - numpy.ndarray: The sorted positions of the kept points, at most 4 per bucket.
+    """
+    n = len(y)
+    if n <= 4 * buckets:
+        return np.arange(n)
+    starts = _buckets(n, buckets)
+    bucket = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, n)))
+    y = np.asarray(y, dtype=np.float64)
+    lowest = np.minimum.reduceat(y, starts)
+    highest = np.maximum.reduceat(y, starts)
+    # First position of each bucket holding its minimum, and its maximum
+    at_min = np.flatnonzero(y == lowest[bucket])
+    at_max = np.flatnonzero(y == highest[bucket])
+    at_min = at_min[np.unique(bucket[at_min], return_index=True)[1]]
+    at_max = at_max[np.unique(bucket[at_max], return_index=True)[1]]
+    ends = np.append(starts[1:], n) - 1
+    return np.unique(np.concatenate([starts, at_min, at_max, ends]))
+
+def lttb(x, y, threshold):
+    """
+    Downsample a line to `threshold` points with the Largest-Triangle-Three-Buckets algorithm.
+
+    The first and last points are kept, and each bucket in between keeps the point forming the largest triangle
+    with the point kept in the previous bucket and the average of the next bucket, which preserves the visual shape.
+
+    Parameters:
+    - x (numpy.ndarray): The sorted x coordinates, for instance int64 times.
+    - y (numpy.ndarray): The y coordinates.
+    - threshold (int): The number of points kept, at least 3.
+
+    Returns:
+    - numpy.ndarray: The sorted positions of the kept points.
+    """
+    n = len(y)
+    if n <= threshold or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # The points between the first and the last are split into threshold - 2 buckets
+    edges = 1 + _buckets(n - 2, threshold - 2)
+    edges = np.append(edges, n - 1)
+    # Average of each bucket, the last point standing for the bucket after the last one
+    sizes = np.diff(edges)
+    mean_x = np.append(np.add.reduceat(x[1:-1], edges[:-1] - 1) / sizes, x[-1])
+    mean_y = np.append(np.add.reduceat(y[1:-1], edges[:-1] - 1) / sizes, y[-1])
+
+    kept = np.empty(len(edges) + 1, dtype=np.int64)
+    kept[0] = 0
+    a = 0
+    for i in range(len(edges) - 1):
+        lo, hi = edges[i], edges[i + 1]
+        # Twice the area of the triangle formed by the last kept point, each candidate and the next average
+        area = np.abs((x[a] - mean_x[i + 1]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (mean_y[i + 1] - y[a]))
+        a = lo + int(np.argmax(area))
+        kept[i + 1] = a
+    kept[-1] = n - 1
+    return kept
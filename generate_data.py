@@ -2,42 +2,208 @@ import pandas as pd
 import numpy as np
 from opensimplex import OpenSimplex
 import datetime
+import hashlib
+import json
+import os
+import shutil
+import tempfile
 
-def generate_greenhouse_data(filepath):
+# Bump when the layout of the cache directories changes
+CACHE_VERSION = 1
+
+def filter_greenhouse_data(df, min_value=0, max_value=50, max_diff=6, previous=None, by=None):
     """
-    Generate filtered greenhouse data from a CSV file.
-    
+    Filter out implausible greenhouse readings.
+
     Parameters:
-    filepath (str): The path to the CSV file.
-    
+    df (pandas.DataFrame): The raw readings, with a 'value' column.
+    min_value (float): Readings must be strictly above this value. Defaults to 0.
+    max_value (float): Readings must be strictly below this value. Defaults to 50.
+    max_diff (float): The maximum absolute difference from the previous reading. Defaults to 6.
+    previous (float or pandas.Series, optional): The raw reading just before `df`, when `df` is a chunk of a larger file.
+        With `by`, a Series of the last raw reading of each sensor.
+    by (str, optional): The column identifying the sensor of each row. When given, each reading is compared with the previous reading of the same sensor.
+
     Returns:
-    pandas.DataFrame: The filtered greenhouse data.
+    pandas.DataFrame: The filtered readings.
     """
-    
-    # Rest of the code...
-def generate_greenhouse_data(filepath):
 
-    # Read the CSV file into a DataFrame, parsing 'time' as datetime
-    df = pd.read_csv(filepath, parse_dates=["time"], dtype={"id": str, "value": float})
-    
     # Compute the absolute differences between consecutive temperature readings
-    df['diff'] = df['value'].diff().abs()
+    if by is None:
+        diff = df['value'].diff()
+        if previous is not None and not df.empty:
+            diff.iloc[0] = df['value'].iloc[0] - previous
+    else:
+        diff = df.groupby(by, observed=True, sort=False)['value'].diff()
+        if previous is not None:
+            first = ~df[by].duplicated().to_numpy()
+            before = df[by][first].map(previous).to_numpy(dtype=float)
+            diff[first] = df['value'][first].to_numpy() - before
+    diff = diff.abs()
     
     # Initial value for 'diff' will be NaN; we can fill it with 0 or a small number
-    df['diff'] = df['diff'].fillna(0)
+    diff = diff.fillna(0)
     
     # Filter the DataFrame:
-    # 1. Exclude temperature values that are too high (>50) or too low (<-10)
-    # 2. Exclude rows where the difference from the previous reading is greater than 6
-    filtered_df = df[(df['value'] > 0) & (df['value'] < 50) & (df['diff'] <= 6)]
+    # 1. Exclude temperature values that are too high or too low
+    # 2. Exclude rows where the difference from the previous reading is too large
+    return df[(df['value'] > min_value) & (df['value'] < max_value) & (diff <= max_diff)]
+
+def _csv_dtypes(by):
+    dtypes = {"id": str, "value": float}
+    if by is not None:
+        dtypes[by] = "category"
+    return dtypes
+
+def _cache_dir(filepath, cache_dir, params):
+    # The entries of a source and parameters share a prefix, so that a new version of the source replaces only theirs
+    stat = os.stat(filepath)
+    source = json.dumps([os.path.abspath(filepath), params])
+    version = json.dumps([CACHE_VERSION, stat.st_mtime_ns, stat.st_size])
+    stem = f"{os.path.basename(filepath)}-{hashlib.sha1(source.encode()).hexdigest()[:16]}"
+    return os.path.join(cache_dir, f"{stem}-{hashlib.sha1(version.encode()).hexdigest()[:16]}"), stem
+
+def _write_cache(df, path, stem):
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix=".tmp-")
+    columns = []
+    for i, column in enumerate(df.columns):
+        data = df[column]
+        if isinstance(data.dtype, pd.DatetimeTZDtype):
+            np.save(os.path.join(tmp, f"{i}.npy"), data.dt.tz_convert("UTC").dt.tz_localize(None).to_numpy())
+            columns.append({"name": column, "kind": "datetimetz", "tz": str(data.dt.tz)})
+        elif pd.api.types.is_numeric_dtype(data) or pd.api.types.is_datetime64_dtype(data):
+            np.save(os.path.join(tmp, f"{i}.npy"), data.to_numpy())
+            columns.append({"name": column, "kind": "array"})
+        else:
+            # Strings are stored as categorical codes and their categories
+            categorical = data.astype("category")
+            np.save(os.path.join(tmp, f"{i}.npy"), categorical.cat.codes.to_numpy())
+            np.save(os.path.join(tmp, f"{i}.categories.npy"), categorical.cat.categories.to_numpy(dtype=str))
+            columns.append({"name": column, "kind": "category", "dtype": str(data.dtype)})
+    np.save(os.path.join(tmp, "index.npy"), df.index.to_numpy())
+    with open(os.path.join(tmp, "columns.json"), "w") as f:
+        json.dump(columns, f)
+
+    # Replace any stale entry for the same source and parameters, then publish atomically
+    for entry in os.listdir(parent):
+        if entry.startswith(stem + "-"):
+            shutil.rmtree(os.path.join(parent, entry), ignore_errors=True)
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def _read_cache(path, mmap=False):
+    mmap_mode = "r" if mmap else None
+    with open(os.path.join(path, "columns.json")) as f:
+        columns = json.load(f)
+    data = {}
+    for i, column in enumerate(columns):
+        values = np.load(os.path.join(path, f"{i}.npy"), mmap_mode=mmap_mode)
+        if column["kind"] == "datetimetz":
+            values = pd.Series(values).dt.tz_localize("UTC").dt.tz_convert(column["tz"]).array
+        elif column["kind"] == "category":
+            categories = np.load(os.path.join(path, f"{i}.categories.npy"))
+            values = pd.Series(pd.Categorical.from_codes(values, categories=categories)).astype(column["dtype"]).array
+        data[column["name"]] = values
+    index = np.load(os.path.join(path, "index.npy"), mmap_mode=mmap_mode)
+    return pd.DataFrame(data, index=index, copy=False)
+
+def generate_greenhouse_data(filepath, cache_dir=None, min_value=0, max_value=50, max_diff=6, by=None, mmap=False):
+    """
+    Generate filtered greenhouse data from a CSV file.
+
+    The filtered data is cached as .npy files in `cache_dir`, keyed by the modification
+    time and size of the CSV file and by the filter parameters, so later calls skip parsing and filtering.
     
-    # Drop the 'diff' column as it's no longer needed after filtering
-    filtered_df = filtered_df.drop(columns=['diff'])
+    Parameters:
+    filepath (str): The path to the CSV file.
+    cache_dir (str, optional): The cache directory. Defaults to a '.cache' directory next to the CSV file, False disables the cache.
+    min_value (float): Readings must be strictly above this value. Defaults to 0.
+    max_value (float): Readings must be strictly below this value. Defaults to 50.
+    max_diff (float): The maximum absolute difference from the previous reading. Defaults to 6.
+    by (str, optional): The column identifying the sensor of each row, usually 'id'. When given, readings are compared
+        with the previous reading of the same sensor and the column is read as a categorical.
+    mmap (bool): Whether a cached frame is memory-mapped instead of read into memory. Its columns are then read-only
+        and shared with the other processes reading the cache. Defaults to False.
     
+    Returns:
+    pandas.DataFrame: The filtered greenhouse data.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(filepath), ".cache")
+    if cache_dir is not False:
+        path, stem = _cache_dir(filepath, cache_dir, [min_value, max_value, max_diff, by])
+        if os.path.isdir(path):
+            return _read_cache(path, mmap)
+
+    # Read the CSV file into a DataFrame, parsing 'time' as datetime
+    df = pd.read_csv(filepath, parse_dates=["time"], dtype=_csv_dtypes(by))
+    filtered_df = filter_greenhouse_data(df, min_value, max_value, max_diff, by=by)
+
+    if cache_dir is not False:
+        _write_cache(filtered_df, path, stem)
     return filtered_df
 
 
-def generate_simplex(start_time=None, end_time=None, interval=600, max_temp=30, min_temp=10, frequency=10):
+def stream_greenhouse_data(filepath, chunksize=100000, min_value=0, max_value=50, max_diff=6, by=None):
+    """
+    Generate filtered greenhouse data from a CSV file, one chunk at a time.
+
+    The last raw reading of each chunk is carried over to the next one, so the result is the same
+    as generate_greenhouse_data while memory stays bounded by the chunk size.
+
+    Parameters:
+    filepath (str): The path to the CSV file.
+    chunksize (int): The number of CSV rows read at a time. Defaults to 100000.
+    min_value (float): Readings must be strictly above this value. Defaults to 0.
+    max_value (float): Readings must be strictly below this value. Defaults to 50.
+    max_diff (float): The maximum absolute difference from the previous reading. Defaults to 6.
+    by (str, optional): The column identifying the sensor of each row. When given, the last raw reading of each sensor is carried over.
+
+    Yields:
+    pandas.DataFrame: The filtered rows of each chunk.
+    """
+    previous = None
+    with pd.read_csv(filepath, parse_dates=["time"], dtype=_csv_dtypes(by), chunksize=chunksize) as reader:
+        for chunk in reader:
+            if chunk.empty:
+                continue
+            yield filter_greenhouse_data(chunk, min_value, max_value, max_diff, previous, by)
+            if by is None:
+                previous = chunk['value'].iloc[-1]
+            else:
+                last = chunk.drop_duplicates(by, keep='last').set_index(by)['value']
+                previous = last if previous is None else last.combine_first(previous)
+
+def write_greenhouse_data(filepath, output, chunksize=100000, min_value=0, max_value=50, max_diff=6, by=None):
+    """
+    Filter greenhouse data from a CSV file into another CSV file without loading it whole.
+
+    Parameters:
+    filepath (str): The path to the source CSV file.
+    output (str): The path to the filtered CSV file.
+    chunksize (int): The number of CSV rows read at a time. Defaults to 100000.
+    min_value (float): Readings must be strictly above this value. Defaults to 0.
+    max_value (float): Readings must be strictly below this value. Defaults to 50.
+    max_diff (float): The maximum absolute difference from the previous reading. Defaults to 6.
+    by (str, optional): The column identifying the sensor of each row.
+
+    Returns:
+    int: The number of rows written.
+    """
+    count = 0
+    header = True
+    for chunk in stream_greenhouse_data(filepath, chunksize, min_value, max_value, max_diff, by):
+        chunk.to_csv(output, mode="w" if header else "a", header=header, index=False)
+        header = False
+        count += len(chunk)
+    return count
+
+
+def generate_simplex(start_time=None, end_time=None, interval=600, max_temp=30, min_temp=10, frequency=10, seed=None, sensors=None):
     """
     Generate a DataFrame with time and temperature values using Simplex noise.
 
@@ -48,33 +214,69 @@ def generate_simplex(start_time=None, end_time=None, interval=600, max_temp=30,
     - max_temp (float): The maximum temperature value. Defaults to 30.
     - min_temp (float): The minimum temperature value. Defaults to 10.
     - frequency (int): The frequency parameter for the Simplex noise generator. Defaults to 10.
+    - seed (int, optional): The seed of the Simplex noise generator. Defaults to a random seed.
+    - sensors (int, optional): The number of sensors. When given, an 'id' column is added and each sensor gets its own trace.
 
     Returns:
     - df (DataFrame): A pandas DataFrame with 'time' and 'value' columns representing the generated time and temperature values.
     """
+    chunks = stream_simplex(start_time, end_time, interval, max_temp, min_temp, frequency, seed, sensors, chunksize=None)
+    return pd.concat(chunks, ignore_index=True)
+
+def stream_simplex(start_time=None, end_time=None, interval=600, max_temp=30, min_temp=10, frequency=10, seed=None, sensors=None, chunksize=1000000):
+    """
+    Generate time and temperature values using Simplex noise, one chunk at a time.
+
+    Times are built as datetime64 ranges and the noise of a whole chunk is computed with a single array call,
+    so traces of hundreds of millions of points can be written out without holding them in memory.
+
+    Parameters:
+    - start_time, end_time, interval, max_temp, min_temp, frequency: See generate_simplex.
+    - seed (int, optional): The seed of the Simplex noise generator. Defaults to a random seed. Sensor i uses seed + i.
+    - sensors (int, optional): The number of sensors. When given, an 'id' column is added and each sensor gets its own trace.
+    - chunksize (int, optional): The number of rows per chunk, at least one time step of every sensor. None generates everything
+      in one chunk. Defaults to 1000000.
+
+    Yields:
+    - DataFrame: The 'time' and 'value' columns, and the categorical 'id' column with `sensors`, of each chunk.
+    """
     
     # Default time settings if none provided
     if end_time is None:
         end_time = datetime.datetime.now()
     if start_time is None:
         start_time = end_time - datetime.timedelta(days=1)
+    if seed is None:
+        seed = np.random.randint(0, 1000)
     
     # Calculate the number of samples needed based on the interval
     total_seconds = int((end_time - start_time).total_seconds())
-    steps = total_seconds // interval
-    
-    # Time array
-    times = [start_time + datetime.timedelta(seconds=i * interval) for i in range(steps + 1)]
-    
-    # Simplex noise generator
-    simplex = OpenSimplex(seed=np.random.randint(0, 1000))
-    
-    # Generate noise values and scale them
-    temperatures = [simplex.noise2(x=i / frequency, y=0) for i in range(steps + 1)]
-    
-    # Map Simplex noise output (usually in range [-1, 1]) to the [min_temp, max_temp]
-    scaled_temperatures = min_temp + (np.array(temperatures) + 1) / 2 * (max_temp - min_temp)
-    
-    # Create DataFrame
-    df = pd.DataFrame({'time': times, 'value': scaled_temperatures})
-    return df
+    steps = total_seconds // interval + 1
+
+    # Simplex noise generators, one per sensor
+    ids = range(sensors if sensors is not None else 1)
+    simplexes = [OpenSimplex(seed=seed + i) for i in ids]
+
+    # Every chunk holds the same time steps of all the sensors
+    chunk_steps = max(steps, 1) if chunksize is None else max(chunksize // len(simplexes), 1)
+    start = pd.Timestamp(start_time)
+    y = np.zeros(1)
+
+    for lo in range(0, steps, chunk_steps):
+        i = np.arange(lo, min(lo + chunk_steps, steps))
+
+        # Time array
+        times = start + pd.to_timedelta(i * interval, unit="s")
+
+        # Generate noise values and scale them
+        temperatures = np.concatenate([simplex.noise2array(i / frequency, y)[0] for simplex in simplexes])
+
+        # Map Simplex noise output (usually in range [-1, 1]) to the [min_temp, max_temp]
+        scaled_temperatures = min_temp + (temperatures + 1) / 2 * (max_temp - min_temp)
+
+        # Create DataFrame
+        df = pd.DataFrame({'time': np.tile(times, len(simplexes)), 'value': scaled_temperatures})
+        if sensors is not None:
+            codes = np.repeat(np.arange(sensors, dtype=np.int32), len(i))
+            df.insert(0, 'id', pd.Categorical.from_codes(codes, categories=[str(s) for s in ids]))
+        yield df
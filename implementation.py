@@ -1,7 +1,13 @@
+import datetime
+import math
 import time
 import requests
 from dotenv import load_dotenv
 import os
+import threading
+import metrics
+from policies import LearnedRatePolicy
+from telemetry import TelemetryBatch, TelemetryQueue, Backoff, PollSchedule
 
 dT = 0.5
 
@@ -34,30 +40,112 @@ RATE_OF_CHANGE = [
 
 load_dotenv()
 
-def poll_data():
+# Keep-alive connections reused by every poll and push
+session = requests.Session()
+
+def poll_data(timeout=10):
     # make a api call to http://quentin.com/api/temperature
-    res = requests.get(os.getenv("SENSOR_API_URL")).json()
-    return res["temperature"]
+    with metrics.POLL_SECONDS.time(metrics.POLL_FAILURES):
+        res = session.get(os.getenv("SENSOR_API_URL"), timeout=timeout)
+        res.raise_for_status()
+        return res.json()["temperature"]
+
+def push_batch(readings, url=None, push_session=session):
+    with metrics.PUSH_SECONDS.time(metrics.PUSH_FAILURES):
+        res = push_session.post(url or os.getenv("API_URL"), json=readings, timeout=10)
+        res.raise_for_status()
+    metrics.PUSHED_READINGS.inc(len(readings))
+    print(f"Pushed {len(readings)} readings")
+
+def drain(queue, max_rate=5, idle=1):
+    """
+    Push the batches of the queue forever, oldest first, at most `max_rate` requests per second.
+
+    Failed pushes are retried with exponential backoff, so a server coming back after an outage
+    receives the backlog at a bounded rate. Batches rejected with a client error are dropped.
+    Runs in its own thread with its own connection so that polling never waits on a push.
+
+    Parameters:
+    - queue (TelemetryQueue): The queue of batches to push.
+    - max_rate (float): The maximum number of pushes per second. Defaults to 5.
+    - idle (float): The number of seconds to wait when the queue is empty. Defaults to 1.
+    """
+    push_session = requests.Session()
+    backoff = Backoff()
+    while True:
+        batch = queue.peek()
+        if batch is None:
+            time.sleep(idle)
+            continue
+        batch_id, url, readings = batch
+        try:
+            push_batch(readings, url, push_session)
+        except requests.HTTPError as e:
+            if e.response.status_code not in (408, 429) and e.response.status_code < 500:
+                print(f"Dropped {len(readings)} readings: {e}")
+                metrics.DROPPED_READINGS.inc(len(readings))
+                queue.ack(batch_id)
+                continue
+            print(f"Push failed: {e}")
+            time.sleep(backoff.failure())
+            continue
+        except requests.RequestException as e:
+            print(f"Push failed: {e}")
+            time.sleep(backoff.failure())
+            continue
+        queue.ack(batch_id)
+        backoff.success()
+        time.sleep(1 / max_rate)
 
-def push_data(temperature):
-    print(f"Pushed data: {temperature}")
-    requests.post(os.getenv("API_URL"), json={"temperature": temperature})
+def sleep_and_flush(deadline, batch, flush):
+    # Sleep until the monotonic deadline, waking up to push the batch when it gets too old
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        time.sleep(min(remaining, batch.time_to_flush()))
+        if batch.due():
+            flush()
 
 def main():
-    temperature = poll_data()
-    push_data(temperature)
+    metrics.configure()
+    batch = TelemetryBatch(int(os.getenv("PUSH_BATCH_SIZE", 100)), float(os.getenv("PUSH_MAX_LATENCY", 60)))
+    queue = TelemetryQueue(os.getenv("QUEUE_PATH", "telemetry.db"))
+    threading.Thread(target=drain, args=(queue, float(os.getenv("PUSH_MAX_RATE", 5))), daemon=True).start()
+
+    def flush():
+        queue.put(os.getenv("API_URL"), batch.take())
+
+    #wait until the temperature is expected to change by dT between polls, following the rate of change of the hours crossed
+    #and learning the rates from the readings
+    policy = LearnedRatePolicy(RATE_OF_CHANGE, dT, decay=float(os.getenv("RATE_DECAY", 0)), path=os.getenv("RATE_STATE_PATH", "rates.json"),
+                               interpolate=True)
+    schedule = PollSchedule(float(os.getenv("POLL_JITTER", 0.05)))
+    backoff = Backoff()
+    deadline = None
     while True:
-        #get hour of the day
-        current_hour = time.localtime().tm_hour
-        #get the rate of change for the current hour
-        rate_of_change = RATE_OF_CHANGE[current_hour]
-        #calculate the wait before the next poll
-        wait_time = 3600 * dT / rate_of_change
-        #wait
-        time.sleep(wait_time)
-        #poll data
-        new_temperature = poll_data()
-        print(f"New temperature: {new_temperature}")
-        #push data
-        push_data(new_temperature)
-    
+        if deadline is not None:
+            metrics.POLL_DRIFT.observe(time.monotonic() - deadline)
+        #poll data, retrying with backoff when the sensor API fails or hangs
+        try:
+            temperature = poll_data()
+            print(f"New temperature: {temperature}")
+            #buffer data
+            batch.add(temperature)
+            backoff.success()
+            #calculate the wait before the next poll
+            wait_time = policy.observe(datetime.datetime.now(), temperature)
+            if math.isfinite(wait_time):
+                metrics.POLL_INTERVAL.observe(wait_time)
+        except (requests.RequestException, KeyError, ValueError) as e:
+            print(f"Poll failed: {e!r}")
+            wait_time = backoff.failure()
+        if batch.due():
+            flush()
+        #calculate the deadline of the next poll from the deadline of this one
+        deadline = schedule.next(wait_time)
+        #wait, queuing the buffered readings when they are due
+        sleep_and_flush(deadline, batch, flush)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import aiohttp
+import metrics
+import service
+from policies import ConstantPolicy
+from telemetry import TelemetryQueue
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+async def _wait_ready(session, url, timeout=60):
+    # Wait for the mock server to answer, it first generates its traces
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        try:
+            async with session.get(url) as res:
+                return await res.json()
+        except aiohttp.ClientError:
+            if asyncio.get_running_loop().time() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+def _histogram_summary(histogram, counts, total):
+    # Summarize the values observed by a metrics.Histogram since its bucket counts were `counts` and its sum `total`.
+    # A quantile is interpolated linearly within its bucket, as by the histogram_quantile of Prometheus
+    counts = [count - before for count, before in zip(histogram.counts, counts)]
+    observed = sum(counts)
+    if not observed:
+        return {"count": 0}
+    summary = {"count": observed, "mean": (histogram.sum - total) / observed}
+    for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+        rank, seen, lower = q * observed, 0, 0.0
+        for bound, count in zip(histogram.buckets + (math.inf,), counts):
+            if count and seen + count >= rank:
+                # Above the last bucket only its bound is known
+                summary[name] = lower if bound == math.inf else lower + (bound - lower) * (rank - seen) / count
+                break
+            seen, lower = seen + count, bound
+    return summary
+
+async def load_test(sensors=100, interval=1, duration=30, warmup=5, batch_size=100, max_latency=60, max_rate=1000, limit=100,
+                    delay=0, failure_rate=0, jitter=0.0):
+    """
+    Run service.serve against a local MockSensors server and measure its sustained throughput and latency.
+
+    The mock server runs in its own process so that it does not share the event loop or the interpreter of the poller.
+    Every sensor is polled with a ConstantPolicy of `interval` seconds. The latency of a poll is timed by the poller,
+    from the request to the reading, including the wait for a free connection, with metrics.POLL_SECONDS, which is
+    enabled for the run. Polls are scheduled on absolute deadlines, so the time between two polls of a sensor only
+    drifts from `interval` when the poller falls behind, and is reported separately as the cadence of the polls.
+    The counters are reset after `warmup` seconds, once every sensor has been polled and the connections are open.
+
+    Parameters:
+    - sensors (int): The number of sensors polled. Defaults to 100.
+    - interval (float): The number of seconds between two polls of a sensor. Defaults to 1.
+    - duration (float): The number of seconds measured. Defaults to 30.
+    - warmup (float): The number of seconds run before measuring. Defaults to 5.
+    - batch_size, max_latency, max_rate, limit: See service.serve. The push rate is not limited to 50 by default.
+    - delay (float): The number of seconds the mock server takes to answer. Defaults to 0.
+    - failure_rate (float): The probability that the mock server fails a request. Defaults to 0.
+    - jitter (float): See service.serve. Defaults to 0, so that the intervals are exactly `interval` on time.
+
+    Returns:
+    - dict: The measures:
+      - 'polls_per_second', 'pushes_per_second', 'readings_per_second' (float): The sustained rates seen by the server.
+      - 'poll_latency' (dict): The mean, p50, p95 and p99 of the duration of the polls, in seconds. The quantiles are
+        interpolated within the buckets of metrics.DURATION_BUCKETS.
+      - 'poll_gap' (dict): The mean, p50, p95, p99 and max of the time between two polls of a sensor, in seconds.
+      - 'push_delay' (dict): The same summary of the time between the timestamp of a reading and its arrival, in seconds.
+      - 'failures' (int): The number of requests failed on purpose by the server.
+      - 'backlog' (int): The number of batches still waiting to be pushed at the end.
+    """
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock.py"), "--port", str(port),
+         "--sensors", str(sensors), "--delay", str(delay), "--failure-rate", str(failure_rate)],
+        stdout=subprocess.DEVNULL,
+    )
+    enabled = metrics.REGISTRY.enabled
+    metrics.REGISTRY.enabled = True
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            async with aiohttp.ClientSession() as session:
+                await _wait_ready(session, f"{base}/stats")
+                queue_path = os.path.join(workdir, "telemetry.db")
+                # The poller logs every reading, which would flood the output
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    poller = asyncio.create_task(service.serve(
+                        [str(sensor) for sensor in range(sensors)], f"{base}/api/{{id}}/temperature", f"{base}/api/v1/{{id}}/telemetry",
+                        limit=limit, batch_size=batch_size, max_latency=max_latency, queue_path=queue_path, max_rate=max_rate,
+                        make_policy=lambda sensor_id: ConstantPolicy(interval), jitter=jitter,
+                    ))
+                    await asyncio.sleep(warmup)
+                    async with session.delete(f"{base}/stats"):
+                        pass
+                    counts, total = list(metrics.POLL_SECONDS.counts), metrics.POLL_SECONDS.sum
+                    await asyncio.sleep(duration)
+                    async with session.get(f"{base}/stats") as res:
+                        stats = await res.json()
+                    poll_latency = _histogram_summary(metrics.POLL_SECONDS, counts, total)
+                    poller.cancel()
+                    with contextlib.suppress(asyncio.CancelledError):
+                        await poller
+                backlog = len(TelemetryQueue(queue_path))
+    finally:
+        metrics.REGISTRY.enabled = enabled
+        server.terminate()
+        server.wait()
+
+    return {
+        "polls_per_second": stats["polls"] / stats["elapsed"],
+        "pushes_per_second": stats["pushes"] / stats["elapsed"],
+        "readings_per_second": stats["readings"] / stats["elapsed"],
+        "poll_latency": {name: poll_latency[name] for name in ("mean", "p50", "p95", "p99") if name in poll_latency},
+        "poll_gap": {name: stats["poll_gap"][name] for name in ("mean", "p50", "p95", "p99", "max") if name in stats["poll_gap"]},
+        "push_delay": {name: stats["push_delay"][name] for name in ("mean", "p50", "p95", "p99", "max") if name in stats["push_delay"]},
+        "failures": stats["failures"],
+        "backlog": backlog,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test service.py against a local mock sensor API and telemetry endpoint.")
+    parser.add_argument("--sensors", type=int, nargs="+", default=[100], help="numbers of sensors polled, one run each")
+    parser.add_argument("--interval", type=float, default=1, help="seconds between two polls of a sensor")
+    parser.add_argument("--duration", type=float, default=30, help="seconds measured in each run")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds run before measuring")
+    parser.add_argument("--batch-size", type=int, default=100, help="readings pushed in a single request")
+    parser.add_argument("--max-latency", type=float, default=60, help="longest time in seconds a reading waits to be pushed")
+    parser.add_argument("--max-rate", type=float, default=1000, help="maximum number of pushes per second")
+    parser.add_argument("--limit", type=int, default=100, help="maximum number of simultaneous connections")
+    parser.add_argument("--delay", type=float, default=0, help="seconds the mock server takes to answer")
+    parser.add_argument("--failure-rate", type=float, default=0, help="probability that the mock server fails a request")
+    parser.add_argument("--jitter", type=float, default=0, help="largest move of a poll around its deadline, as a fraction of the interval")
+    args = parser.parse_args(argv)
+
+    for sensors in args.sensors:
+        results = asyncio.run(load_test(sensors, args.interval, args.duration, args.warmup, args.batch_size, args.max_latency,
+                                        args.max_rate, args.limit, args.delay, args.failure_rate, args.jitter))
+        print(json.dumps({"sensors": sensors, **results}))
+
+if __name__ == "__main__":
+    main()
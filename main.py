@@ -1,8 +1,25 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-from generate_data import *
-from analyze import *
-from poll import *
+import argparse
+import os
+import profiling
+
+# Only the standard library and profiling.py, which only uses it, are imported here: pandas, matplotlib and the analysis modules are imported
+# by the functions that use them, so that the serve command starts without loading them
+
+# Parameter grid (start, stop, step) and plot label of each strategy compared in comparaison_mean
+SWEEPS = {
+    "every_kth_point": ((1, 10, 1), "Constant Polling Interval"),
+    "reglin": ((0.4, 3, 0.05), "Linear Regression"),
+    "optimal": ((0.1, 3, 0.05), "Optimal Polling rate"),
+    "avg_rate_of_change": ((0.01, 3, 0.05), "Hourly Rate of Change"),
+}
+
+def sweep_grid(strategy):
+    """
+    Return the parameter values of a strategy of SWEEPS as a numpy array.
+    """
+    import numpy as np
+
+    return np.arange(*SWEEPS[strategy][0])
 
 def sort(X, Y):
     """
@@ -24,24 +41,87 @@ def sort(X, Y):
     """
     return zip(*sorted(zip(X, Y)))
 
-def plot_temperature_data(df, recent_count=None):
+def split_sweep(results, X):
+    """
+    Split a table returned by run_sweep into the lists returned by the test_* functions.
+
+    Args:
+        results (pandas.DataFrame): The sweep results, in the same order as X.
+        X (numpy.ndarray): The parameter values of the sweep.
+
+    Returns:
+        tuple: X and the EFFICIENCY, MEAN, MEDIAN and STD lists.
+    """
+    return X, list(results["efficiency"]), list(results["mean"]), list(results["median"]), list(results["std"])
+
+def _plot_times(data):
+    import pandas as pd
+    from series import CompactSeries, data_time_ns
+
+    # Local wall times as datetime64, which matplotlib converts much faster than Timestamps
+    tz = data.tz if isinstance(data, CompactSeries) else getattr(data["time"].dt, "tz", None)
+    times = data_time_ns(data)
+    if tz is not None:
+        times = pd.DatetimeIndex(times, tz="UTC").tz_convert(tz).tz_localize(None).asi8
+    return times.view("datetime64[ns]")
+
+def _downsample(times, values, method, max_points):
+    import numpy as np
+    from downsample import minmax, lttb
+
+    if method is None or len(values) <= max_points:
+        return np.arange(len(values))
+    if method == "minmax":
+        # Up to 4 points per bucket
+        return minmax(times.view(np.int64), values, max_points // 4)
+    if method == "lttb":
+        return lttb(times.view(np.int64), values, max_points)
+    raise ValueError(f"Unknown downsampling method '{method}'.")
+
+@profiling.profiled()
+def plot_temperature_data(df, recent_count=None, sampled=None, method="minmax", max_points=2000):
     """
     Plots the temperature data from a DataFrame.
 
+    Traces longer than `max_points` are downsampled before drawing, so that full histories render quickly.
+
     Args:
-        df (pandas.DataFrame): The DataFrame containing the temperature data.
+        df (pandas.DataFrame or CompactSeries): The DataFrame containing the temperature data.
         recent_count (int, optional): The number of recent data points to plot. If specified, only the last 'recent_count' rows will be plotted. Defaults to None.
+        sampled (dict, optional): Sampled points to draw over the trace, as a DataFrame or CompactSeries for each label,
+            e.g. {"Linear Regression": sample_reglin(df)}. Defaults to None.
+        method (str, optional): How long traces are downsampled: "minmax" keeps the extremes of each pixel column,
+            "lttb" keeps the points that best preserve the shape, None draws every point. Defaults to "minmax".
+        max_points (int, optional): The number of points above which a trace is downsampled, about the pixel width of the plot. Defaults to 2000.
 
     Returns:
         None
     """
+    import numpy as np
+    import matplotlib.pyplot as plt
+    from series import CompactSeries, data_values
+
     plt.figure(figsize=(5, 5))
     
     # Check if recent_count is specified and valid
     if recent_count is not None and recent_count > 0:
-        df = df.tail(recent_count)  # Slice the DataFrame to get the last 'recent_count' rows
+        # Slice the DataFrame to get the last 'recent_count' rows
+        if isinstance(df, CompactSeries):
+            df = df.take(np.arange(max(len(df) - recent_count, 0), len(df)))
+        else:
+            df = df.tail(recent_count)
     
-    plt.plot(df['time'], df['value'], label='Temperature', color='tab:red', marker='x')
+    times, values = _plot_times(df), data_values(df)
+    if len(values) <= max_points:
+        plt.plot(times, values, label='Temperature', color='tab:red', marker='x')
+    else:
+        kept = _downsample(times, values, method, max_points)
+        plt.plot(times[kept], values[kept], label='Temperature', color='tab:red', linewidth=0.8)
+
+    for label, points in (sampled or {}).items():
+        kept = _downsample(_plot_times(points), data_values(points), method, max_points)
+        plt.scatter(_plot_times(points)[kept], data_values(points)[kept], label=label, marker='o', s=12, zorder=3)
+
     plt.xlabel('Time')
     plt.ylabel('Temperature (°C)')
     plt.grid(True)
@@ -50,12 +130,13 @@ def plot_temperature_data(df, recent_count=None):
     plt.tight_layout()  # Adjusts subplot params so that the subplot(s) fits in to the figure area.
     plt.show()
 
-def test_sample_every_kth_point(df):
+def test_sample_every_kth_point(df, processes=None):
     """
     Test the sample_every_kth_point function with different values of k.
 
     Parameters:
     - df: The input DataFrame containing the data.
+    - processes: The number of worker processes. Defaults to the number of cores.
 
     Returns:
     - X: The array of values used for sampling.
@@ -65,24 +146,10 @@ def test_sample_every_kth_point(df):
     - STD: The standard deviation of error values for each sampling.
     """
     
-    X = np.arange(1, 10, 1)
-    MEAN = []
-    STD = []
-    MEDIAN = []
-    EFFICIENCY = []
-    for x in X:
-        print(x)
-        df_sampled = sample_every_kth_point(df, int(x))
-        # plot_temperature_data(df)
-
-        diff = error(df_sampled, df, 'value')
-
-        MEAN.append(np.mean(diff))
-        STD.append(np.std(diff))
-        MEDIAN.append(np.median(diff))
-        EFFICIENCY.append(compute_efficiency(df_sampled))
-    
-    return X, EFFICIENCY, MEAN, MEDIAN, STD
+    from sweep import run_sweep
+
+    X = sweep_grid("every_kth_point")
+    return split_sweep(run_sweep(df, [("every_kth_point", x) for x in X], None, processes), X)
 
 
 def example_sample_every_kth_point(k=10):
@@ -95,6 +162,9 @@ def example_sample_every_kth_point(k=10):
     Returns:
     None
     """
+    from generate_data import generate_greenhouse_data
+    from poll import sample_every_kth_point
+
     df  = generate_greenhouse_data("datasets/greenhouse.csv")
     df = df.tail(150)
     df = sample_every_kth_point(df, k)
@@ -106,6 +176,9 @@ def example_sample_reglin():
     It generates greenhouse data, selects the last 150 rows, applies the sample_reglin function,
     and plots the temperature data.
     """
+    from generate_data import generate_greenhouse_data
+    from poll import sample_reglin
+
     df  = generate_greenhouse_data("datasets/greenhouse.csv")
     df = df.tail(150)
     df = sample_reglin(df)
@@ -121,6 +194,9 @@ def example_optimal_sample(dT = 0.3):
     Returns:
         None
     """
+    from generate_data import generate_greenhouse_data
+    from poll import optimal_sample
+
     df  = generate_greenhouse_data("datasets/greenhouse.csv")
     df = df.tail(150)
     df = optimal_sample(df, threshold_dT=dT)
@@ -139,19 +215,25 @@ def example_sample_avg_rate_of_change():
     Returns:
     None
     """
+    from analyze import hourly_rate_of_change
+    from generate_data import generate_greenhouse_data
+    from poll import sample_avg_rate_of_change
+
     df  = generate_greenhouse_data("datasets/greenhouse.csv")
     hroc = hourly_rate_of_change(df)
     df = df.tail(150)
     df = sample_avg_rate_of_change(df, 3600 * 1 / hroc)
     plot_temperature_data(df)
 
-def test_sample_reglin(df):
+def test_sample_reglin(df, processes=None):
     """
     Perform a test on the sample_reglin function with different values of max_dT.
 
     Parameters:
     - df: DataFrame
         The input DataFrame containing temperature data.
+    - processes: int, optional
+        The number of worker processes. Defaults to the number of cores.
 
     Returns:
     - X: ndarray
@@ -165,31 +247,19 @@ def test_sample_reglin(df):
     - STD: list
         A list of standard deviation error values calculated for each max_dT value.
     """
-    X = np.arange(0.4, 3, 0.05)
-    MEAN = []
-    STD = []
-    MEDIAN = []
-    EFFICIENCY = []
-    for x in X:
-        print(x)
-        df_sampled = sample_reglin(df, max_dT=x)
-        # plot_temperature_data(df)
-
-        diff = error(df_sampled, df, 'value')
+    from sweep import run_sweep
 
-        MEAN.append(np.mean(diff))
-        STD.append(np.std(diff))
-        MEDIAN.append(np.median(diff))
-        EFFICIENCY.append(compute_efficiency(df_sampled))
-    return X, EFFICIENCY, MEAN, MEDIAN, STD
+    X = sweep_grid("reglin")
+    return split_sweep(run_sweep(df, [("reglin", x) for x in X], None, processes), X)
 
 
-def test_optimal_sample(df):
+def test_optimal_sample(df, processes=None):
     """
     Test the optimal sample function with different threshold values.
 
     Args:
         df (pandas.DataFrame): The input DataFrame containing temperature data.
+        processes (int, optional): The number of worker processes. Defaults to the number of cores.
 
     Returns:
         tuple: A tuple containing the following lists:
@@ -199,25 +269,12 @@ def test_optimal_sample(df):
             - MEDIAN (list): A list of median error values for each threshold.
             - STD (list): A list of standard deviation error values for each threshold.
     """
-    X = np.arange(0.1, 3, 0.05)
-    MEAN = []
-    STD = []
-    MEDIAN = []
-    EFFICIENCY = []
-    for x in X:
-        print(x)
-        df_sampeld= optimal_sample(df, threshold_dT=x)
-        # plot_temperature_data(df)
+    from sweep import run_sweep
 
-        diff = error(df_sampeld,df, 'value')
+    X = sweep_grid("optimal")
+    return split_sweep(run_sweep(df, [("optimal", x) for x in X], None, processes), X)
 
-        MEAN.append(np.mean(diff))
-        STD.append(np.std(diff))
-        MEDIAN.append(np.median(diff))
-        EFFICIENCY.append(compute_efficiency(df_sampeld))
-    return X, EFFICIENCY, MEAN, MEDIAN, STD
-
-def test_sample_avg_rate_of_change(df, hourly_rate_of_change):
+def test_sample_avg_rate_of_change(df, hourly_rate_of_change, processes=None):
     """
     Test the sample average rate of change.
 
@@ -227,6 +284,7 @@ def test_sample_avg_rate_of_change(df, hourly_rate_of_change):
     Parameters:
     - df (pandas.DataFrame): The input DataFrame containing the data.
     - hourly_rate_of_change (float): The hourly rate of change.
+    - processes (int, optional): The number of worker processes. Defaults to the number of cores.
 
     Returns:
     - X (numpy.ndarray): An array of values ranging from 0.01 to 3 with a step of 0.05.
@@ -235,25 +293,20 @@ def test_sample_avg_rate_of_change(df, hourly_rate_of_change):
     - MEDIAN (list): A list of median values calculated for each sample.
     - STD (list): A list of standard deviation values calculated for each sample.
     """
-    X = np.arange(0.01, 3, 0.05)
-    MEAN = []
-    STD = []
-    MEDIAN = []
-    EFFICIENCY = []
-    for x in X:
-        print(x)
-        df_sampled = sample_avg_rate_of_change(df, 3600 * x / hourly_rate_of_change)
-        # plot_temperature_data(df)
+    from sweep import run_sweep
 
-        diff = error(df_sampled, df, 'value')
+    X = sweep_grid("avg_rate_of_change")
+    return split_sweep(run_sweep(df, [("avg_rate_of_change", x) for x in X], hourly_rate_of_change, processes), X)
 
-        MEAN.append(np.mean(diff))
-        STD.append(np.std(diff))
-        MEDIAN.append(np.median(diff))
-        EFFICIENCY.append(compute_efficiency(df_sampled))
-    return X, EFFICIENCY, MEAN, MEDIAN, STD
+def tail(df, limit, by=None):
+    """
+    Keep the last `limit` rows of a trace, or of the trace of each sensor with `by`.
+    """
+    if by is None:
+        return df.tail(limit)
+    return df.groupby(by, observed=True, sort=False).tail(limit)
 
-def comparaison_mean(df, limit=1000):
+def comparaison_mean(df, limit=1000, processes=None, max_error=None, by=None):
     """
     Compare different sampling methods based on their mean and efficiency.
 
@@ -262,36 +315,49 @@ def comparaison_mean(df, limit=1000):
         The input DataFrame containing the data.
     - limit: int, optional
         The number of rows to consider from the end of the DataFrame. Default is 1000.
+    - processes: int, optional
+        The number of worker processes. Defaults to the number of cores.
+    - max_error: float, optional
+        When given, search and print the parameter of each strategy with the most seconds between polls
+        among those with a mean error of at most max_error, see sweep.cheapest_parameter.
+    - by: str, optional
+        The column identifying the sensor of each row. When given, sensors are sampled separately and `limit` rows are
+        kept for each sensor.
 
     Returns:
     None
     """
-    plt.figure(figsize=(10, 5))
-    hroc = hourly_rate_of_change(df)
-    df = df.tail(limit)
-    X, EFFICIENCY, MEAN, MEDIAN, STD = test_sample_every_kth_point(df)
-    MEAN, EFFICIENCY = sort(MEAN, EFFICIENCY)
-    plt.plot(MEAN, EFFICIENCY, label="Constant Polling Interval", marker='x')
-
-    X, EFFICIENCY, MEAN, MEDIAN, STD = test_sample_reglin(df)
-    MEAN, EFFICIENCY = sort(MEAN, EFFICIENCY)
-    plt.plot(MEAN, EFFICIENCY, label="Linear Regression", marker='x')
-
-    X, EFFICIENCY, MEAN, MEDIAN, STD = test_optimal_sample(df)
-    MEAN, EFFICIENCY = sort(MEAN, EFFICIENCY)
-    plt.plot(MEAN, EFFICIENCY, label="Optimal Polling rate", marker='x')
-
-    X, EFFICIENCY, MEAN, MEDIAN, STD = test_sample_avg_rate_of_change(df, hroc)
-    MEAN, EFFICIENCY = sort(MEAN, EFFICIENCY)
-    plt.plot(MEAN, EFFICIENCY, label="Hourly Rate of Change", marker='x')
+    import matplotlib.pyplot as plt
+    from analyze import hourly_rate_of_change
+    from sweep import cheapest_parameter, refine_sweep
 
-    plt.ylabel("Average seconds between polls")
-    plt.xlabel("Average error")
-    plt.ylim(0, 8000)
-    plt.xlim(0, 1.3)
-
-    plt.legend()
-    plt.show()
+    plt.figure(figsize=(10, 5))
+    hroc = hourly_rate_of_change(df, by)
+    df = tail(df, limit, by)
+
+    # Refine each strategy only where its frontier moves inside the plotted window
+    ranges = {strategy: (sweep_grid(strategy)[0], sweep_grid(strategy)[-1]) for strategy in SWEEPS}
+    results = refine_sweep(df, ranges, hroc, processes, by, window=(1.3, 8000))
+    with profiling.stage("plot"):
+        for strategy, (grid, label) in SWEEPS.items():
+            points = results[results["strategy"] == strategy].sort_values("mean")
+            plt.plot(points["mean"], points["efficiency"], label=label, marker='x')
+
+        plt.ylabel("Average seconds between polls")
+        plt.xlabel("Average error")
+        plt.ylim(0, 8000)
+        plt.xlim(0, 1.3)
+
+        plt.legend()
+        plt.show()
+
+    if max_error is not None:
+        for strategy, (grid, label) in SWEEPS.items():
+            best = cheapest_parameter(df, strategy, max_error, *ranges[strategy], hroc, processes, by)
+            if best is None:
+                print(f"{label}: no parameter with a mean error of at most {max_error:g}")
+            else:
+                print(f"{label}: parameter {best['parameter']:.3g}, mean error {best['mean']:.3f}, {best['efficiency']:.0f} s between polls")
 
 def example_optimal_sample(dT = 0.3):
     """
@@ -303,6 +369,10 @@ def example_optimal_sample(dT = 0.3):
     Returns:
         None
     """
+    import matplotlib.pyplot as plt
+    from generate_data import generate_greenhouse_data
+    from poll import optimal_sample
+
     df  = generate_greenhouse_data("datasets/greenhouse.csv")
     df = df.tail(1000)
     df = optimal_sample(df, threshold_dT=dT)
@@ -324,46 +394,164 @@ def histogram_sample_every_kth_point(k=10):
     Returns:
     None
     """
+    from analyze import error, plot_histogram
+    from generate_data import generate_greenhouse_data
+    from poll import sample_every_kth_point
+
     df  = generate_greenhouse_data("datasets/greenhouse.csv")
     df = df.tail(1000)
     df_sampled = sample_every_kth_point(df, k)
-    diff = error(df, df_sampled, 'value')
+    diff = error(df_sampled, df, 'value')
     plot_histogram(diff)
 
-# histogram_sample_every_kth_point(1)
-# df  = generate_greenhouse_data("datasets/greenhouse.csv")
-# df = df.tail(1000)
-
-#Comparaison of the mean error with simplex
-# df = generate_simplex(interval=600, frequency=10)
-# plt.plot(df['time'], df['value'], label='Temperature', color='tab:red', marker='x')
-# plt.show()
-# comparaison_mean(df)
-#Same thing with the greenhouse data
-# df = generate_greenhouse_data("datasets/greenhouse.csv")
-# df = df.tail(1000)
-# plt.plot(df['time'], df['value'], label='Temperature', color='tab:red', marker='x')
-# plt.show()
-# comparaison_mean(df)
-
-# Temperature rate of change over the day
-# df = generate_greenhouse_data("datasets/greenhouse.csv")
-# hcor = hourly_rate_of_change(df)
-# print(hcor)
-# hcor.plot()
-# plt.xlabel("Hour of the day")
-# plt.ylabel("Average absolute rate of change (°C/hour)")
-# plt.show()
-# plt.ylabel("Aboslute rate of change of the temperature (°C/hour)")
-# plt.xlabel("Hour of the day")
-# plt.show()
-
-# df = generate_greenhouse_data("datasets/greenhouse.csv")
-# comparaison_mean(df, 1000)
-
-# example_sample_every_kth_point(1)
-# example_sample_every_kth_point(10)
-# exaample_optimal_sample()
-# example_sample_reglin()
-# example_sample_avg_rate_of_change()
-    # Calculate differences between consecutive rows for the specified column
\ No newline at end of file
+@profiling.profiled("ingest")
+def load_data(path="datasets/greenhouse.csv", simplex=False, limit=None, by=None):
+    """
+    Load the trace analysed by the commands.
+
+    Parameters:
+    - path (str): The greenhouse CSV file. Defaults to 'datasets/greenhouse.csv'.
+    - simplex (bool): Generate a Simplex noise trace instead of reading `path`. Defaults to False.
+    - limit (int, optional): The number of rows kept from the end of the trace, of each sensor with `by`. Defaults to all of them.
+    - by (str, optional): The column identifying the sensor of each row, read as a categorical. The Simplex noise trace
+      is then a single sensor '0'. Defaults to a single trace.
+
+    Returns:
+    - pandas.DataFrame: The 'time' and 'value' columns of the trace, and the `by` column with `by`.
+    """
+    from generate_data import generate_greenhouse_data, generate_simplex
+
+    if simplex:
+        df = generate_simplex(interval=600, frequency=10, sensors=1 if by is not None else None)
+        if by is not None:
+            df = df.rename(columns={"id": by})
+    else:
+        df = generate_greenhouse_data(path, by=by)
+    return tail(df, limit, by) if limit else df
+
+def command_sweep(args):
+    from analyze import hourly_rate_of_change
+    from sweep import run_sweep, refine_sweep
+
+    df = load_data(args.data, args.simplex, by=args.by)
+    hroc = hourly_rate_of_change(df, args.by)
+    df = tail(df, args.limit, args.by)
+    strategies = args.strategies or list(SWEEPS)
+    if args.grid:
+        results = run_sweep(df, [(strategy, x) for strategy in strategies for x in sweep_grid(strategy)], hroc, args.processes, args.by)
+    else:
+        ranges = {strategy: (sweep_grid(strategy)[0], sweep_grid(strategy)[-1]) for strategy in strategies}
+        results = refine_sweep(df, ranges, hroc, args.processes, args.by)
+    if args.output:
+        results.to_csv(args.output, index=False)
+    else:
+        print(results.to_string(index=False))
+
+def command_compare(args):
+    comparaison_mean(load_data(args.data, args.simplex, by=args.by), args.limit, args.processes, args.max_error, args.by)
+
+def command_histogram(args):
+    from analyze import error, hourly_rate_of_change, plot_histogram
+    from sweep import sample
+
+    df = load_data(args.data, args.simplex, by=args.by)
+    hroc = hourly_rate_of_change(df, args.by) if args.strategy == "avg_rate_of_change" else None
+    df = tail(df, args.limit, args.by)
+    df_sampled = sample(df, args.strategy, args.parameter, hroc, args.by)
+    plot_histogram(error(df_sampled, df, 'value', args.by), bins=args.bins, title=f"{SWEEPS[args.strategy][1]} ({args.parameter:g})")
+
+def command_simulate(args):
+    import datetime
+    from generate_data import stream_simplex
+    from policies import ConstantPolicy, HourlyRatePolicy, RegLinPolicy
+    from series import CompactSeries
+    from simulate import simulate
+
+    by = args.by
+    if args.sensors:
+        start = datetime.datetime(2024, 1, 1)
+        chunks = stream_simplex(start, start + datetime.timedelta(days=args.days), interval=600, seed=0, sensors=args.sensors)
+        df, by = CompactSeries.from_frames(chunks, "id"), "id"
+    else:
+        df = load_data(args.data, args.simplex, args.limit, by)
+    if args.policy == "constant":
+        make_policy = lambda sensor: ConstantPolicy(args.parameter)
+    elif args.policy == "reglin":
+        make_policy = lambda sensor: RegLinPolicy(args.parameter)
+    else:
+        from implementation import RATE_OF_CHANGE
+        make_policy = lambda sensor: HourlyRatePolicy(RATE_OF_CHANGE, args.parameter, interpolate=True)
+    results = simulate(df, make_policy, by, batch_size=args.batch_size, max_latency=args.max_latency, keep_polled=False)
+    print(f"polls: {results['polls']}, pushes: {results['pushes']}, bytes: {results['bytes']}")
+    print(", ".join(f"{name}: {value:g}" for name, value in results["error"].summary().items()))
+
+def command_serve(args):
+    multi = args.multi if args.multi is not None else bool(os.getenv("SENSOR_IDS"))
+    if multi:
+        import service
+        service.main()
+    else:
+        import implementation
+        implementation.main()
+
+def cli(argv=None):
+    """
+    Run a command of the command line interface, for instance `python main.py compare --limit 1000`.
+
+    Parameters:
+    - argv (list, optional): The arguments. Defaults to those of the process.
+    """
+    parser = argparse.ArgumentParser(description="Compare polling strategies on recorded or generated traces, or run the poller.")
+    parser.add_argument("--profile", choices=["time", "memory", "cprofile"],
+                        help="print the wall time and calls of each stage of the command, their peak allocations with memory, "
+                             "or the cProfile statistics of every function")
+    parser.add_argument("--profile-output", help="file the profile is written to, as folded stacks for flamegraph.pl or speedscope, "
+                                                 "or as pstats data with cprofile")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    data = argparse.ArgumentParser(add_help=False)
+    data.add_argument("--data", default="datasets/greenhouse.csv", help="greenhouse CSV file")
+    data.add_argument("--simplex", action="store_true", help="use a generated Simplex noise trace instead of --data")
+    data.add_argument("--limit", type=int, default=1000, help="number of rows kept from the end of the trace, of each sensor with --by")
+    data.add_argument("--by", help="column identifying the sensor of each row, e.g. id, to sample each sensor separately")
+    data.add_argument("--processes", type=int, help="worker processes, the number of cores by default")
+
+    sweep = commands.add_parser("sweep", parents=[data], help="evaluate strategies over their parameters and print the results")
+    sweep.add_argument("--strategies", nargs="+", choices=list(SWEEPS), help="strategies to evaluate, all by default")
+    sweep.add_argument("--grid", action="store_true", help="evaluate the whole parameter grid instead of refining it adaptively")
+    sweep.add_argument("--output", help="CSV file the results are written to instead of being printed")
+    sweep.set_defaults(run=command_sweep)
+
+    compare = commands.add_parser("compare", parents=[data], help="plot the error against the polling interval of every strategy")
+    compare.add_argument("--max-error", type=float, help="search and print the cheapest parameter of each strategy with at most this mean error")
+    compare.set_defaults(run=command_compare)
+
+    histogram = commands.add_parser("histogram", parents=[data], help="plot the distribution of the error of a strategy")
+    histogram.add_argument("--strategy", choices=list(SWEEPS), default="every_kth_point")
+    histogram.add_argument("--parameter", type=float, default=10, help="parameter of the strategy, 10 by default")
+    histogram.add_argument("--bins", type=int, default=10)
+    histogram.set_defaults(run=command_histogram)
+
+    simulate = commands.add_parser("simulate", parents=[data], help="replay the trace through a live polling policy on a virtual clock")
+    simulate.add_argument("--policy", choices=["constant", "reglin", "hourly_rate"], default="hourly_rate")
+    simulate.add_argument("--parameter", type=float, default=0.5, help="interval in seconds of constant, dT of the others, 0.5 by default")
+    simulate.add_argument("--sensors", type=int, help="simulate this many generated Simplex noise sensors instead of --data")
+    simulate.add_argument("--days", type=float, default=365, help="length of the traces of --sensors, a year by default")
+    simulate.add_argument("--batch-size", type=int, default=100, help="readings pushed in a single request")
+    simulate.add_argument("--max-latency", type=float, default=60, help="longest time in seconds a reading waits to be pushed")
+    simulate.set_defaults(run=command_simulate)
+
+    serve = commands.add_parser("serve", help="poll the sensors and push their readings, configured by the .env file")
+    serve.add_argument("--multi", action=argparse.BooleanOptionalAction, help="poll many sensors with service.py, by default when SENSOR_IDS is set")
+    serve.set_defaults(run=command_serve)
+
+    args = parser.parse_args(argv)
+    if args.profile is None:
+        args.run(args)
+        return
+    with profiling.profile(args.profile, args.profile_output):
+        with profiling.stage(args.command):
+            args.run(args)
+
+if __name__ == "__main__":
+    cli()
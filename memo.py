@@ -0,0 +1,124 @@
+import collections
+import hashlib
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from series import time_ns, value_array, sensor_codes
+
+# Bump when the samplers or the error statistics change, so that results cached on disk are not reused
+CACHE_VERSION = 2
+
+def fingerprint(df, by=None, index=False):
+    """
+    Hash the time, value and sensor columns of a DataFrame.
+
+    Parameters:
+    - df (pandas.DataFrame or pandas.Series): The data, or a table such as the hourly rate of change, whose index and values are hashed.
+    - by (str, optional): The column identifying the sensor of each row.
+    - index (bool): Whether the index of a DataFrame is hashed too. Defaults to False.
+
+    Returns:
+    - str: The hexadecimal BLAKE2b digest of the content.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    if "time" in getattr(df, "columns", ()):
+        digest.update(str(getattr(df["time"].dt, "tz", None)).encode())
+        arrays = [time_ns(df["time"]), value_array(df["value"])]
+        if by is not None:
+            codes, categories = sensor_codes(df[by])
+            arrays += [codes, pd.util.hash_pandas_object(pd.Index(categories.astype(str)), index=False).to_numpy()]
+        if index:
+            if isinstance(df.index, pd.RangeIndex):
+                digest.update(repr(df.index).encode())
+            else:
+                arrays.append(pd.util.hash_pandas_object(df.index).to_numpy())
+    else:
+        arrays = [pd.util.hash_pandas_object(df, index=True).to_numpy()]
+    for array in arrays:
+        digest.update(str(array.shape).encode())
+        digest.update(np.ascontiguousarray(array).data)
+    return digest.hexdigest()
+
+class ResultCache:
+    """
+    Content-addressed cache of sampler results, such as sampled DataFrames or their error statistics.
+
+    Values are pickled and kept in memory in least recently used order, dropping the oldest ones once they
+    take more than `max_bytes`. With a `path`, every value is also written to a file of that directory,
+    so that results survive between sessions; files are never evicted.
+
+    Parameters:
+    - max_bytes (int): The memory taken by the pickled values kept in memory. Defaults to 256 MB.
+    - path (str, optional): The directory of the on-disk tier. Defaults to memory only.
+    """
+
+    def __init__(self, max_bytes=256 * 2 ** 20, path=None):
+        self.max_bytes = max_bytes
+        self.path = path
+        self.size = 0
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def key(*parts):
+        """
+        Build the key of a result from its inputs, for instance a fingerprint, a strategy name and a parameter.
+        Numbers are normalized so that equal values of different types share a key.
+        """
+        parts = [repr(float(part)) if isinstance(part, (int, float, np.number)) else repr(part) for part in parts]
+        return hashlib.blake2b("\0".join([str(CACHE_VERSION), *parts]).encode(), digest_size=16).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, f"{key}.pkl")
+
+    def _remember(self, key, data):
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key))
+        if len(data) > self.max_bytes:
+            return
+        self.entries[key] = data
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            self.size -= len(self.entries.popitem(last=False)[1])
+
+    def get(self, key):
+        """
+        Return the value cached under `key`, or None.
+        """
+        data = self.entries.get(key)
+        if data is not None:
+            self.entries.move_to_end(key)
+        elif self.path is not None and os.path.exists(self._file(key)):
+            with open(self._file(key), "rb") as f:
+                data = f.read()
+            self._remember(key, data)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(data)
+
+    def put(self, key, value):
+        """
+        Cache `value` under `key`.
+        """
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._remember(key, data)
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+            tmp = f"{self._file(key)}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._file(key))
+
+    def clear(self):
+        """
+        Empty the in-memory tier.
+        """
+        self.entries.clear()
+        self.size = 0
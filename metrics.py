@@ -0,0 +1,231 @@
+import bisect
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds of the buckets of the histograms of durations, from 1 ms to 10 minutes
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Upper bounds in seconds of the buckets of the histogram of polling intervals, from 1 second to 6 hours
+INTERVAL_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 900, 1800, 3600, 7200, 14400, 21600)
+
+class Registry:
+    """
+    Counters, gauges and histograms of the pollers, exposed in the Prometheus text format or as JSON.
+
+    Metrics are created once, at import, and updated in place. While the registry is disabled every update returns
+    after a single attribute check and timers do not read the clock, so instrumented code runs at full speed.
+    Updates are not locked: a metric should be updated from one thread, or a concurrent update may be lost.
+
+    Parameters:
+    - enabled (bool): Whether updates are recorded. Defaults to False.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.metrics = {}
+
+    def _add(self, metric):
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help):
+        return self._add(Counter(self, name, help))
+
+    def gauge(self, name, help):
+        return self._add(Gauge(self, name, help))
+
+    def histogram(self, name, help, buckets=DURATION_BUCKETS):
+        return self._add(Histogram(self, name, help, buckets))
+
+    def render(self):
+        """
+        Return the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """
+        Return the metrics as a dict of plain values, for a JSON dump.
+        """
+        return {"time": time.time(), **{metric.name: metric.value() for metric in self.metrics.values()}}
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, registry, name, help):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.count = 0
+
+    def inc(self, amount=1):
+        if self.registry.enabled:
+            self.count += amount
+
+    def value(self):
+        return self.count
+
+    def samples(self):
+        return [f"{self.name} {self.count}"]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value):
+        if self.registry.enabled:
+            self.count = value
+
+class Histogram:
+    """
+    Count the observed values in fixed buckets, as a Prometheus histogram, and keep their sum.
+    """
+    kind = "histogram"
+
+    def __init__(self, registry, name, help, buckets=DURATION_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        # The last count is for the values above the last bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        if self.registry.enabled:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self, failures=None):
+        """
+        Return a context manager observing the seconds spent in its block, and incrementing the `failures` counter when
+        the block raises an exception.
+        """
+        if not self.registry.enabled:
+            return _NO_TIMER
+        return _Timer(self, failures)
+
+    def cumulative(self):
+        counts, total = [], 0
+        for count in self.counts:
+            total += count
+            counts.append(total)
+        return counts
+
+    def value(self):
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        return {"count": self.count, "sum": self.sum, "buckets": dict(zip(bounds, self.cumulative()))}
+
+    def samples(self):
+        bounds = [repr(float(bound)) for bound in self.buckets] + ["+Inf"]
+        lines = [f'{self.name}_bucket{{le="{bound}"}} {count}' for bound, count in zip(bounds, self.cumulative())]
+        lines.append(f"{self.name}_sum {self.sum!r}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+class _Timer:
+    __slots__ = ("histogram", "failures", "start")
+
+    def __init__(self, histogram, failures):
+        self.histogram = histogram
+        self.failures = failures
+
+    def __enter__(self):
+        # perf_counter is monotonic, with a better resolution than monotonic
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        self.histogram.observe(time.perf_counter() - self.start)
+        if kind is not None and self.failures is not None:
+            self.failures.inc()
+        return False
+
+class _NoTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        return False
+
+_NO_TIMER = _NoTimer()
+
+REGISTRY = Registry()
+
+# Metrics of the pollers, shared by implementation.py and service.py
+POLL_SECONDS = REGISTRY.histogram("poller_poll_seconds", "Duration of the requests to the sensor API.")
+POLL_FAILURES = REGISTRY.counter("poller_poll_failures_total", "Polls that failed.")
+PUSH_SECONDS = REGISTRY.histogram("poller_push_seconds", "Duration of the requests pushing telemetry.")
+PUSH_FAILURES = REGISTRY.counter("poller_push_failures_total", "Pushes that failed, including those retried.")
+PUSHED_READINGS = REGISTRY.counter("poller_pushed_readings_total", "Readings pushed.")
+DROPPED_READINGS = REGISTRY.counter("poller_dropped_readings_total", "Readings dropped after a push rejected by the server.")
+POLL_INTERVAL = REGISTRY.histogram("poller_poll_interval_seconds", "Finite waits before the next poll returned by the polling policy.",
+                                   INTERVAL_BUCKETS)
+POLL_DRIFT = REGISTRY.histogram("poller_poll_drift_seconds", "Time between the planned start of a poll and its actual start.")
+
+def serve(port, host="", registry=REGISTRY):
+    """
+    Serve the metrics over HTTP from a daemon thread: /metrics in the Prometheus text format, and /metrics.json.
+
+    Returns:
+    - ThreadingHTTPServer: The server, whose shutdown method stops it.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = registry.render().encode(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = json.dumps(registry.snapshot()).encode(), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def dump(path, interval=60, registry=REGISTRY):
+    """
+    Write the metrics as JSON to `path` every `interval` seconds from a daemon thread, replacing the file atomically.
+    """
+
+    def run():
+        while True:
+            time.sleep(interval)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump(registry.snapshot(), f)
+            os.replace(tmp, path)
+
+    threading.Thread(target=run, daemon=True).start()
+
+def configure(registry=REGISTRY):
+    """
+    Enable the metrics when METRICS_PORT or METRICS_PATH is set, serving them on that port or dumping them to that file
+    every METRICS_INTERVAL seconds (60 by default).
+    """
+    port = os.getenv("METRICS_PORT")
+    path = os.getenv("METRICS_PATH")
+    if port:
+        serve(int(port), registry=registry)
+    if path:
+        dump(path, float(os.getenv("METRICS_INTERVAL", 60)), registry)
+    registry.enabled = bool(port or path)
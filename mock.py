@@ -0,0 +1,198 @@
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import time
+import numpy as np
+from aiohttp import web
+from series import time_ns, value_array, sensor_codes
+from stats import ErrorStats
+
+class _Recorder:
+    # Collect durations one at a time, summarizing them with an ErrorStats a few thousand at a time
+
+    def __init__(self, size=4096):
+        self.size = size
+        self.pending = []
+        self.stats = ErrorStats()
+
+    def add(self, value):
+        self.pending.append(value)
+        if len(self.pending) >= self.size:
+            self.flush()
+
+    def flush(self):
+        self.stats.update(self.pending)
+        self.pending = []
+
+    def summary(self):
+        self.flush()
+        return self.stats.summary() if self.stats.count else {"count": 0}
+
+class MockSensors:
+    """
+    Local stand-in for the sensor API and the ThingsBoard telemetry endpoint, to run and load test the pollers without hardware.
+
+    Each sensor replays a trace in a loop, starting when the server starts, and a poll returns the value interpolated at the
+    current time. Pushes are only counted. For every sensor the server records the time between consecutive polls and,
+    for every pushed reading, the time between its timestamp and its arrival.
+
+    Routes:
+    - GET /api/{id}/temperature and GET /api/temperature, the first sensor: {"temperature": value}.
+    - POST /api/v1/{id}/telemetry and POST /api/v1/telemetry: a reading or an array of readings in the ThingsBoard format.
+    - GET /stats: the counters and the summaries of the recorded durations, DELETE /stats resets them.
+
+    Parameters:
+    - df (pandas.DataFrame): The traces, with 'time' and 'value' columns, sorted by time for each sensor.
+    - by (str, optional): The column identifying the sensor of each row. Without it, every sensor replays the single trace,
+      each one shifted by a fraction of its length.
+    - sensors (list, optional): The ids of the sensors served without `by`. Defaults to a single sensor '0'.
+    - speed (float): The number of seconds of the traces replayed per second. Defaults to 1.
+    - delay (float): The number of seconds added to the handling of every request. Defaults to 0.
+    - failure_rate (float): The probability that a request fails with a 503 error, to exercise the retries. Defaults to 0.
+    """
+
+    def __init__(self, df, by=None, sensors=None, speed=1, delay=0, failure_rate=0):
+        seconds = time_ns(df["time"]) / 1e9
+        values = value_array(df["value"]).astype(np.float64)
+        self.traces = {}
+        if by is not None:
+            codes, categories = sensor_codes(df[by])
+            for code, sensor in enumerate(categories):
+                mine = codes == code
+                self.traces[str(sensor)] = (seconds[mine], values[mine], 0.0)
+        else:
+            sensors = [str(sensor) for sensor in sensors] if sensors is not None else ["0"]
+            span = seconds[-1] - seconds[0] if len(seconds) else 0
+            for i, sensor in enumerate(sensors):
+                self.traces[sensor] = (seconds, values, span * i / len(sensors))
+        self.speed = speed
+        self.delay = delay
+        self.failure_rate = failure_rate
+        self.started = time.monotonic()
+        self.reset()
+
+    def reset(self):
+        """
+        Reset the counters and the recorded durations.
+        """
+        self.since = time.monotonic()
+        self.polls = 0
+        self.pushes = 0
+        self.readings = 0
+        self.failures = 0
+        self.last_polls = {}
+        self.poll_gaps = _Recorder()
+        self.push_delays = _Recorder()
+
+    def temperature(self, sensor):
+        """
+        Return the value of the trace of `sensor` at the current time.
+        """
+        seconds, values, shift = self.traces[sensor]
+        span = seconds[-1] - seconds[0]
+        elapsed = (time.monotonic() - self.started) * self.speed + shift
+        position = seconds[0] + (elapsed % span if span > 0 else 0)
+        return float(np.interp(position, seconds, values))
+
+    async def _handle(self):
+        # Delay the response and decide whether the request fails
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.failure_rate and random.random() < self.failure_rate:
+            self.failures += 1
+            raise web.HTTPServiceUnavailable()
+
+    async def poll(self, request):
+        sensor = request.match_info.get("id", next(iter(self.traces)))
+        if sensor not in self.traces:
+            raise web.HTTPNotFound()
+        await self._handle()
+        now = time.monotonic()
+        last = self.last_polls.get(sensor)
+        if last is not None:
+            self.poll_gaps.add(now - last)
+        self.last_polls[sensor] = now
+        self.polls += 1
+        return web.json_response({"temperature": self.temperature(sensor)})
+
+    async def push(self, request):
+        await self._handle()
+        try:
+            readings = await request.json()
+        except json.JSONDecodeError:
+            raise web.HTTPBadRequest()
+        if isinstance(readings, dict):
+            readings = [readings]
+        now = time.time() * 1000
+        for reading in readings:
+            if isinstance(reading, dict) and "ts" in reading:
+                self.push_delays.add((now - reading["ts"]) / 1000)
+        self.pushes += 1
+        self.readings += len(readings)
+        return web.Response()
+
+    def stats(self):
+        """
+        Return the counters since the last reset, and the summaries of the time between consecutive polls of a sensor
+        and of the time between the timestamp of a pushed reading and its arrival, in seconds.
+        """
+        return {
+            "elapsed": time.monotonic() - self.since,
+            "polls": self.polls,
+            "pushes": self.pushes,
+            "readings": self.readings,
+            "failures": self.failures,
+            "poll_gap": self.poll_gaps.summary(),
+            "push_delay": self.push_delays.summary(),
+        }
+
+    async def get_stats(self, request):
+        return web.json_response(self.stats())
+
+    async def delete_stats(self, request):
+        self.reset()
+        return web.Response()
+
+    def app(self):
+        """
+        Build the aiohttp application serving the routes.
+        """
+        app = web.Application()
+        app.add_routes([
+            web.get("/api/temperature", self.poll),
+            web.get("/api/{id}/temperature", self.poll),
+            web.post("/api/v1/telemetry", self.push),
+            web.post("/api/v1/{id}/telemetry", self.push),
+            web.get("/stats", self.get_stats),
+            web.delete("/stats", self.delete_stats),
+        ])
+        return app
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve generated or recorded traces as a sensor API, and count the pushed telemetry.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--sensors", type=int, default=1, help="number of sensors, with ids 0 to sensors - 1")
+    parser.add_argument("--data", help="greenhouse CSV file replayed by every sensor, instead of a Simplex noise trace for each")
+    parser.add_argument("--days", type=float, default=1, help="length of the generated traces, a day by default")
+    parser.add_argument("--speed", type=float, default=1, help="seconds of the traces replayed per second")
+    parser.add_argument("--delay", type=float, default=0, help="seconds added to the handling of every request")
+    parser.add_argument("--failure-rate", type=float, default=0, help="probability that a request fails with a 503 error")
+    args = parser.parse_args(argv)
+
+    from generate_data import generate_greenhouse_data, generate_simplex
+
+    if args.data:
+        mock = MockSensors(generate_greenhouse_data(args.data), sensors=range(args.sensors), speed=args.speed,
+                           delay=args.delay, failure_rate=args.failure_rate)
+    else:
+        start = datetime.datetime(2024, 1, 1)
+        df = generate_simplex(start, start + datetime.timedelta(days=args.days), interval=600, seed=0, sensors=args.sensors)
+        mock = MockSensors(df, by="id", speed=args.speed, delay=args.delay, failure_rate=args.failure_rate)
+    print(f"Serving {len(mock.traces)} sensors on http://{args.host}:{args.port}/api/{{id}}/temperature")
+    web.run_app(mock.app(), host=args.host, port=args.port, access_log=None, print=None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+import json
+import math
+import os
+
+class ConstantPolicy:
+    """
+    Poll at a constant interval.
+
+    Parameters:
+    - interval (float): The number of seconds between polls.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+
+    def observe(self, time, value):
+        """
+        Feed the reading polled at `time` (datetime) and return the number of seconds to wait before the next poll.
+        """
+        return self.interval
+
+def interpolated_wait(rate, time, dT):
+    """
+    Return the number of seconds after `time` at which the temperature is expected to have changed by dT.
+
+    The rate of change of each hour is taken at the middle of the hour and interpolated linearly in between, and the
+    wait ends when the integral of the interpolated rate from `time` reaches dT, so that a wait crossing hours follows
+    the rates of the hours it crosses instead of the rate of the hour it starts in.
+
+    Parameters:
+    - rate (callable): Returns the rate of change of an hour of the day, in °C per hour.
+    - time (datetime): The start of the wait.
+    - dT (float): The expected temperature change.
+
+    Returns:
+    - float: The wait, infinity when the rates are all zero, NaN when a rate needed is NaN.
+    """
+    rates = [rate(hour) for hour in range(24)]
+    # The change over a whole day is the sum of the rates, whole days are skipped at once
+    day = sum(rates)
+    if math.isnan(day):
+        return math.nan
+    if day <= 0:
+        return math.inf
+    days = math.floor(dT / day)
+    remaining = dT - days * day
+    elapsed = 24.0 * days
+
+    x = time.hour + time.minute / 60 + (time.second + time.microsecond / 1e6) / 3600
+    while True:
+        # Between the middle of hour k, at k + 0.5, and the middle of the next hour
+        k = math.floor(x - 0.5)
+        r0, r1 = rates[k % 24], rates[(k + 1) % 24]
+        slope = r1 - r0
+        a = r0 + slope * (x - k - 0.5)
+        span = k + 1.5 - x
+        area = (a + r1) / 2 * span
+        if area >= remaining:
+            # Solve a * u + slope * u ** 2 / 2 = remaining, in a form that is stable when the slope is close to 0
+            return 3600 * (elapsed + 2 * remaining / (a + math.sqrt(max(a * a + 2 * slope * remaining, 0))))
+        remaining -= area
+        elapsed += span
+        x = k + 1.5
+
+class HourlyRatePolicy:
+    """
+    Poll often when the temperature usually changes fast at this hour of the day: wait 3600 * dT / rate of change of the hour.
+
+    Parameters:
+    - rate_of_change (list or pandas.Series): The average absolute rate of change of each hour of the day, in °C per hour.
+      A Series is looked up by hour label, as returned by hourly_rate_of_change.
+    - dT (float): The temperature change that should be expected between two polls. Defaults to 0.5.
+    - interpolate (bool): Whether the wait follows the rates of the hours it crosses, see interpolated_wait,
+      rather than the rate of the hour of the reading. Defaults to False.
+    """
+
+    def __init__(self, rate_of_change, dT=0.5, interpolate=False):
+        if hasattr(rate_of_change, "reindex"):
+            rate_of_change = rate_of_change.reindex(range(24))
+        self.rate_of_change = [float(rate) for rate in rate_of_change]
+        self.dT = dT
+        self.interpolate = interpolate
+
+    def observe(self, time, value):
+        """
+        Feed the reading polled at `time` (datetime) and return the number of seconds to wait before the next poll.
+        An hour without a known rate of change returns NaN, meaning the sensor is not polled again.
+        """
+        if self.interpolate:
+            return interpolated_wait(self.rate_of_change.__getitem__, time, self.dT)
+        rate = self.rate_of_change[time.hour]
+        if rate == 0:
+            return math.inf
+        return 3600 * self.dT / rate
+
+class RegLinPolicy:
+    """
+    Extrapolate the slope of the last two readings and poll when it predicts a change of max_dT, as sample_reglin does.
+
+    When the last two readings are equal the slope is zero and the next poll is `max_poll_interval` later.
+    When they share a timestamp but differ the slope is infinite and the next poll is immediate.
+    The first reading has no slope and is followed by an immediate poll.
+
+    Parameters:
+    - max_dT (float): The value difference that should be considered significant enough to poll. Defaults to 0.5.
+    - max_poll_interval (float): The longest time in seconds between two polls. Defaults to 2 hours.
+    """
+
+    def __init__(self, max_dT=0.5, max_poll_interval=2 * 3600):
+        self.max_dT = max_dT
+        self.max_poll_interval = max_poll_interval
+        self.last = None
+
+    def observe(self, time, value):
+        """
+        Feed the reading polled at `time` (datetime) and return the number of seconds to wait before the next poll.
+        """
+        last, self.last = self.last, (time, value)
+        if last is None:
+            return 0
+        t0, v0 = last
+        if value == v0:
+            return self.max_poll_interval
+        elapsed = (time - t0).total_seconds()
+        if elapsed == 0:
+            return 0
+        s = abs((value - v0) / elapsed)
+        return min(self.max_dT / s, self.max_poll_interval)
+
+class HourlyRateEstimator:
+    """
+    Incremental estimate of the average absolute rate of change of each hour of the day, in °C per hour.
+
+    Each reading updates the running mean of its hour in O(1). With a decay, older rates weigh less,
+    so that the table follows the seasons: after n more rates of the same hour, a rate weighs (1 - decay) ** n.
+
+    Parameters:
+    - decay (float): The decay applied at each new rate of an hour, between 0 and 1. Defaults to 0, a plain mean.
+    """
+
+    def __init__(self, decay=0.0):
+        self.decay = decay
+        self.means = [math.nan] * 24
+        self.weights = [0.0] * 24
+        self.last = None
+
+    def add_rate(self, hour, rate):
+        """
+        Add a rate of change observed at `hour`. Rates that are not finite are ignored.
+        """
+        if not math.isfinite(rate):
+            return
+        weight = self.weights[hour] * (1 - self.decay) + 1
+        mean = self.means[hour] if self.weights[hour] else 0.0
+        self.means[hour] = mean + (rate - mean) / weight
+        self.weights[hour] = weight
+
+    def update(self, time, value):
+        """
+        Add the rate of change between the previous reading and the reading `value` at `time` (datetime).
+        """
+        if self.last is not None:
+            t0, v0 = self.last
+            elapsed = (time - t0).total_seconds() / 3600
+            if elapsed > 0:
+                self.add_rate(time.hour, abs(value - v0) / elapsed)
+        self.last = (time, value)
+
+    def rate(self, hour):
+        """
+        Return the estimated rate of change of `hour`, NaN if no rate was seen at that hour.
+        """
+        return self.means[hour]
+
+    def save(self, path):
+        """
+        Write the estimator to a JSON file, atomically so that a poller reloading it never reads a partial file.
+        """
+        state = {"decay": self.decay, "means": [None if math.isnan(m) else m for m in self.means], "weights": self.weights}
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Read an estimator written by save.
+        """
+        with open(path) as f:
+            state = json.load(f)
+        estimator = cls(state["decay"])
+        estimator.means = [math.nan if m is None else m for m in state["means"]]
+        estimator.weights = state["weights"]
+        return estimator
+
+class LearnedRatePolicy:
+    """
+    Wait 3600 * dT / rate of change of the hour like HourlyRatePolicy, with a table learned from the polled readings.
+
+    Every reading updates an HourlyRateEstimator, so the intervals adapt to the sensor and the season.
+    Hours without enough data use the `fallback` table. With a `path`, the estimator is loaded from it at start,
+    saved to it every `save_every` readings, and reloaded whenever another process rewrites it.
+
+    Parameters:
+    - fallback (list): The rate of change of each hour used until an hour has `min_weight` of learned rates.
+    - dT (float): The temperature change that should be expected between two polls. Defaults to 0.5.
+    - decay (float): The decay of a new estimator, see HourlyRateEstimator. Defaults to 0.
+    - min_weight (float): The weight of learned rates an hour needs before its learned rate is used. Defaults to 5.
+    - path (str, optional): The JSON file holding the estimator.
+    - save_every (int): The number of readings between two saves. Defaults to 10.
+    - interpolate (bool): Whether the wait follows the rates of the hours it crosses, see interpolated_wait. Defaults to False.
+    """
+
+    def __init__(self, fallback, dT=0.5, decay=0.0, min_weight=5, path=None, save_every=10, interpolate=False):
+        self.fallback = HourlyRatePolicy(fallback, dT)
+        self.dT = dT
+        self.interpolate = interpolate
+        self.min_weight = min_weight
+        self.path = path
+        self.save_every = save_every
+        self.unsaved = 0
+        self.mtime = None
+        self.estimator = HourlyRateEstimator(decay)
+        self.reload()
+
+    def reload(self):
+        """
+        Load the estimator from `path` if the file changed since it was last read or written.
+        """
+        if self.path is None or not os.path.exists(self.path):
+            return
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime != self.mtime:
+            last = self.estimator.last
+            self.estimator = HourlyRateEstimator.load(self.path)
+            self.estimator.last = last
+            self.mtime = mtime
+
+    def save(self):
+        self.estimator.save(self.path)
+        self.mtime = os.stat(self.path).st_mtime_ns
+        self.unsaved = 0
+
+    def observe(self, time, value):
+        """
+        Feed the reading polled at `time` (datetime) and return the number of seconds to wait before the next poll.
+        """
+        self.reload()
+        self.estimator.update(time, value)
+        if self.path is not None:
+            self.unsaved += 1
+            if self.unsaved >= self.save_every:
+                self.save()
+        if self.interpolate:
+            return interpolated_wait(self.rate, time, self.dT)
+        hour = time.hour
+        rate = self.estimator.rate(hour)
+        if self.estimator.weights[hour] < self.min_weight or not rate > 0:
+            return self.fallback.observe(time, value)
+        return 3600 * self.dT / rate
+
+    def rate(self, hour):
+        """
+        Return the rate of change used for `hour`: the learned one, or the fallback one until enough rates were learned.
+        """
+        rate = self.estimator.rate(hour)
+        if self.estimator.weights[hour] < self.min_weight or not rate > 0:
+            return self.fallback.rate_of_change[hour]
+        return rate
@@ -1,7 +1,52 @@
+import array
+import bisect
 import datetime
+import math
+import numpy as np
+import pandas as pd
 from analyze import hourly_rate_of_change
+from profiling import profiled
+from series import CompactSeries, sensor_codes, segments, time_ns, value_array, data_sensor_codes, grouped
 
-def sample_every_kth_point(df, k):
+try:
+    import numba
+except ImportError:
+    numba = None
+
+def _sensor_segments(df, by):
+    """
+    Return the row order grouping `df` by sensor, None when its rows are already grouped, and the start offset of each
+    sensor in that order. Without `by`, the whole DataFrame is a single segment. A CompactSeries is already grouped.
+    """
+    if isinstance(df, CompactSeries):
+        return None, df.starts
+    if by is None:
+        return None, np.array([0, len(df)], dtype=np.int64)
+    codes, categories = sensor_codes(df[by])
+    return segments(codes, len(categories))
+
+def _stored(df, order):
+    """
+    Return the times and values of `df` as stored, in sensor order, with the unit of the times in nanoseconds and the scale
+    of the values: int64 nanoseconds and float64 values of a DataFrame, int32 seconds from the base and float32 or int16
+    values of a CompactSeries. The arrays are only copied to reorder a DataFrame whose sensors are interleaved.
+    """
+    if isinstance(df, CompactSeries):
+        return df.offsets, df.values, 10 ** 9, df.scale or 1.0
+    times, values = time_ns(df["time"]), value_array(df["value"])
+    if order is not None:
+        times, values = times[order], values[order]
+    return times, values, 1, 1.0
+
+def _select(df, order, indices):
+    # Map positions in sensor order back to rows of df, in their original order
+    rows = np.asarray(indices, dtype=np.int64)
+    if order is not None:
+        rows = np.sort(order[rows])
+    return df.take(rows) if isinstance(df, CompactSeries) else df.iloc[rows]
+
+@profiled()
+def sample_every_kth_point(df, k, by=None):
     """
     Sample every k-th point from a DataFrame.
 
@@ -10,6 +55,8 @@ def sample_every_kth_point(df, k):
         The DataFrame from which to sample the points.
     - k: int
         The interval between sampled points.
+    - by: str, optional
+        The column identifying the sensor of each row. When given, every k-th point of each sensor is sampled.
 
     Returns:
     - sampled_df: pandas DataFrame
@@ -25,95 +72,250 @@ def sample_every_kth_point(df, k):
         raise ValueError("k is greater than the number of rows in the DataFrame.")
 
     # Sample every k-th point
+    if isinstance(df, CompactSeries):
+        starts = df.starts.tolist()
+        return df.take(np.concatenate([np.arange(lo, hi, k) for lo, hi in zip(starts[:-1], starts[1:])]))
+    if by is not None:
+        return df[df.groupby(by, observed=True, sort=False).cumcount().to_numpy() % k == 0]
     sampled_df = df.iloc[::k]
     return sampled_df
 
-def optimal_sample(df, threshold_dT=0.5):
+# The kernels mark the sampled positions in a boolean array, a byte per point, rather than listing them
+
+def _optimal_sample_kernel(values, scale, starts, threshold_dT, selected):
+    for g in range(len(starts) - 1):
+        lo, hi = starts[g], starts[g + 1]
+        if lo == hi:
+            continue
+        selected[lo] = True
+        last = values[lo] * scale
+        for i in range(lo + 1, hi):
+            value = values[i] * scale
+            if abs(value - last) > threshold_dT:
+                selected[i] = True
+                last = value
+
+def _avg_rate_of_change_kernel(times, hours, starts, thresholds, selected):
+    for g in range(len(starts) - 1):
+        lo, hi = starts[g], starts[g + 1]
+        if lo == hi:
+            continue
+        table = thresholds[g]
+        selected[lo] = True
+        last = times[lo]
+        for i in range(lo, hi):
+            if times[i] - last > table[hours[i]]:
+                selected[i] = True
+                last = times[i]
+
+if numba is not None:
+    _optimal_sample_kernel = numba.njit(cache=True)(_optimal_sample_kernel)
+    _avg_rate_of_change_kernel = numba.njit(cache=True)(_avg_rate_of_change_kernel)
+
+def _kernel_input(array):
+    # The compiled kernels want arrays, the pure Python ones are faster on lists
+    return array if numba is not None else array.tolist()
+
+@profiled()
+def optimal_sample(df, threshold_dT=0.5, by=None):
     """
     Returns a subset of the input DataFrame `df` containing rows that have a significant change in value.
 
     Parameters:
         df (pandas.DataFrame): The input DataFrame.
         threshold_dT (float, optional): The threshold value for the change in value. Defaults to 0.5.
+        by (str, optional): The column identifying the sensor of each row. When given, each sensor is sampled separately.
 
     Returns:
         pandas.DataFrame: A subset of the input DataFrame `df` containing rows with significant changes in value.
     """
-    
-    t0 = df["time"].iloc[0]
-    indices = [0]
-    times = [t0]
-    for i in range(1, len(df)):
-        dT = abs(df["value"].iloc[i] - df["value"].iloc[indices[-1]])
-        if dT > threshold_dT:
-            times.append(i)
-            indices.append(i)
-    return df.iloc[indices]
+    if df.empty:
+        return _select(df, None, [])
+
+    order, starts = _sensor_segments(df, by)
+    _, values, _, scale = _stored(df, order)
+    selected = np.zeros(len(values), dtype=bool)
+    _optimal_sample_kernel(_kernel_input(values), scale, _kernel_input(starts), float(threshold_dT), selected)
+    return _select(df, order, np.flatnonzero(selected))
         
-def sample_reglin(df, max_dT=0.5, max_poll_interval=2 * 3600):
+def _first_point_after(times, date, lo, n):
+    """
+    Return the position of the first time strictly after `date` before position `n`, searching forward from position `lo`.
+
+    The search gallops forward from the cursor before bisecting, so a sequence of calls with
+    increasing cursors walks the array in amortized linear time.
+    """
+    step = 1
+    hi = lo
+    while hi < n and times[hi] <= date:
+        lo = hi + 1
+        hi = lo + step
+        step *= 2
+    return bisect.bisect_right(times, date, lo, min(hi, n))
+
+@profiled()
+def sample_reglin(df, max_dT=0.5, max_poll_interval=2 * 3600, by=None):
     """
     Returns a subset of the input DataFrame `df` by sampling points based on a linear regression algorithm.
 
+    The DataFrame is walked once with a forward-only cursor over its time and value arrays, so `df` must be sorted by time.
+    When the last two polled values are equal the slope is zero and the next poll is `max_poll_interval` later.
+    When they share a timestamp but differ the slope is infinite and the next point is polled immediately.
+
     Parameters:
     - df (pandas.DataFrame): The input DataFrame containing the time series data.
     - max_dT (float): The value difference that should be considered significant enough to add a new value.
                       Defaults to 0.5.
     - max_poll_interval (int): The maximum time interval allowed between the first and last point in the subset.
                                Defaults to 2 hours (2 * 3600 seconds).
+    - by (str, optional): The column identifying the sensor of each row. When given, each sensor is sampled separately.
 
     Returns:
     - pandas.DataFrame: A subset of the input DataFrame `df` containing the sampled points.
 
-    Raises:
-    - ValueError: If there is no point before the specified date.
-
     """
-    indices = []
+    order, starts = _sensor_segments(df, by)
+    # The walk reads the stored arrays in place, through memoryviews whose items are Python numbers
+    times, values, unit, scale = _stored(df, order)
+    times, values = memoryview(times), memoryview(values)
+    indices = array.array("q")
+
+    for lo, hi in zip(starts[:-1].tolist(), starts[1:].tolist()):
+        if hi - lo >= 2:
+            _reglin_segment(times, values, unit, scale, lo, hi, max_dT, max_poll_interval, indices)
 
-    def get_first_point_after(date):
-        if df[df['time'] > date].empty:
-            raise ValueError("No point before the date")
-        return df[df['time'] > date].iloc[0]
+    return _select(df, order, indices)
 
-    # Get first two points
-    t0 = df["time"].iloc[0]
-    t1 = df["time"].iloc[1]
+def _reglin_segment(times, values, unit, scale, lo, hi, max_dT, max_poll_interval, indices):
+    # Get first two points, using the first row holding each timestamp
+    p0 = lo
+    p1 = bisect.bisect_left(times, times[lo + 1], lo, hi)
 
     while True:
-        v0 = df[df["time"] == t0]["value"].values[0]
-        v1 = df[df["time"] == t1]["value"].values[0]
+        # Times in nanoseconds, relative to the base of a CompactSeries
+        t0, v0 = times[p0] * unit, values[p0] * scale
+        t1, v1 = times[p1] * unit, values[p1] * scale
 
-        # Calculate the slope
-        s = abs((v1 - v0) / (t1 - t0).total_seconds())
+        if v1 == v0:
+            # Zero slope: nothing suggests the value will move soon
+            wait = max_poll_interval
+        elif t1 == t0:
+            # Infinite slope: poll again as soon as possible
+            wait = 0
+        else:
+            # Calculate the slope
+            s = abs((v1 - v0) / ((t1 - t0) / 1e9))
+            wait = min(max_dT / s, max_poll_interval)
 
-        # Add max_dT/s to t1
-        new_t = t1 + datetime.timedelta(seconds=min(max_dT / s, max_poll_interval))
+        # Add max_dT/s to t1, with the microsecond resolution of a timedelta
+        new_t = t1 + datetime.timedelta(seconds=wait) // datetime.timedelta(microseconds=1) * 1000
 
-        try:
-            new_t = get_first_point_after(new_t)["time"]
-            indices.append(df[df["time"] == new_t].index[0])
-            t0 = t1
-            t1 = new_t
-        except ValueError:
+        # The first time strictly after new_t is the first one strictly after it rounded down to the unit
+        p_new = _first_point_after(times, new_t // unit, p1 + 1, hi)
+        if p_new == hi:
             break
+        indices.append(p_new)
+        p0 = p1
+        p1 = p_new
 
-    return df.loc[indices]
+def _poll_rate_ns(poll_rate):
+    """
+    Convert a table of poll intervals in seconds to int64 nanoseconds, with the microsecond resolution of a timedelta.
+    Missing or infinite intervals never trigger a poll.
+    """
+    never = np.iinfo(np.int64).max
+    thresholds = []
+    for seconds in np.asarray(poll_rate, dtype=np.float64).tolist():
+        try:
+            thresholds.append(datetime.timedelta(seconds=seconds) // datetime.timedelta(microseconds=1) * 1000)
+        except (ValueError, OverflowError):
+            thresholds.append(never)
+    return np.array(thresholds, dtype=np.int64)
 
-def sample_avg_rate_of_change(df, poll_rate):
+@profiled()
+def sample_avg_rate_of_change(df, poll_rate, by=None):
     """
     Calculate the sample average rate of change for a given DataFrame.
 
     Args:
         df (pandas.DataFrame): The DataFrame containing the data.
-        poll_rate (pandas.Series): The Series containing the poll rates for each hour.
+        poll_rate (pandas.Series or pandas.DataFrame): The Series containing the poll rates for each hour,
+            or a DataFrame with one row of hourly poll rates per sensor, as returned by hourly_rate_of_change with `by`.
+        by (str, optional): The column identifying the sensor of each row. When given, each sensor is sampled separately.
 
     Returns:
         pandas.DataFrame: The subset of the DataFrame with the indices where the rate of change exceeds the poll rate.
 
+    Raises:
+        IndexError: If `poll_rate` has no entry for an hour present in the data.
+        ValueError: If `poll_rate` is a DataFrame and `by` is not given.
+
+    """
+    if df.empty:
+        return _select(df, None, [])
+
+    order, starts = _sensor_segments(df, by)
+    times, _, unit, _ = _stored(df, order)
+    hours = df.hours() if isinstance(df, CompactSeries) else df["time"].dt.hour.to_numpy(dtype=np.int8)
+    if order is not None:
+        hours = hours[order]
+    if isinstance(poll_rate, pd.DataFrame):
+        # One row of hourly poll rates per sensor, in the order of the segments
+        if not grouped(df, by):
+            raise ValueError("A poll_rate table per sensor requires the 'by' column.")
+        categories = data_sensor_codes(df, by)[1]
+        thresholds = np.array([_poll_rate_ns(row) for row in poll_rate.reindex(categories).to_numpy()], dtype=np.int64)
+    else:
+        thresholds = np.tile(_poll_rate_ns(poll_rate), (len(starts) - 1, 1))
+    if hours.max() >= thresholds.shape[1]:
+        raise IndexError("poll_rate has no entry for every hour of the data.")
+    # A time difference is above a threshold in nanoseconds when it is above the threshold rounded down to the unit
+    thresholds //= unit
+
+    selected = np.zeros(len(times), dtype=bool)
+    _avg_rate_of_change_kernel(_kernel_input(times), _kernel_input(hours), _kernel_input(starts), _kernel_input(thresholds), selected)
+    return _select(df, order, np.flatnonzero(selected))
+
+@profiled()
+def sample_policy(df, make_policy, by=None):
+    """
+    Replay an online polling policy over a dense trace.
+
+    The first row is polled, then each reading is fed to the policy and the next poll is the first row strictly after
+    the returned delay, so the offline evaluation runs the same policy objects as the live poller.
+    A delay that is not finite stops the polling.
+
+    Parameters:
+    - df (pandas.DataFrame): The input DataFrame, sorted by time.
+    - make_policy (callable): Returns a new policy for a sensor id, None without `by`, e.g. `lambda sensor: RegLinPolicy(0.5)`.
+    - by (str, optional): The column identifying the sensor of each row. When given, each sensor is replayed with its own policy.
+
+    Returns:
+    - pandas.DataFrame: The polled rows of `df`.
     """
-    indices = [0]
-    for i in range(len(df)):
-        current_hour = df["time"].iloc[i].hour
-        if df["time"].iloc[i] - df["time"].iloc[indices[-1]] > datetime.timedelta(seconds=poll_rate.iloc[current_hour]):
+    order, starts = _sensor_segments(df, by)
+    times, values, unit, scale = _stored(df, order)
+    times, values = memoryview(times), memoryview(values)
+    base = df.base if isinstance(df, CompactSeries) else 0
+    tz = df.tz if isinstance(df, CompactSeries) else getattr(df["time"].dt, "tz", None)
+    sensors = data_sensor_codes(df, by)[1] if grouped(df, by) else [None]
+    indices = array.array("q")
+
+    for sensor, lo, hi in zip(sensors, starts[:-1].tolist(), starts[1:].tolist()):
+        if lo == hi:
+            continue
+        policy = make_policy(sensor)
+        i = lo
+        while True:
             indices.append(i)
-    return df.iloc[indices]
+            time = times[i] * unit
+            delay = policy.observe(pd.Timestamp(base + time, tz=tz), values[i] * scale)
+            if not math.isfinite(delay):
+                break
+            # Add the delay with the microsecond resolution of a timedelta
+            new_t = time + datetime.timedelta(seconds=delay) // datetime.timedelta(microseconds=1) * 1000
+            i = _first_point_after(times, new_t // unit, i + 1, hi)
+            if i == hi:
+                break
+
+    return _select(df, order, indices)
@@ -0,0 +1,191 @@
+import contextlib
+import cProfile
+import functools
+import io
+import pstats
+import sys
+import time
+import tracemalloc
+
+class Profiler:
+    """
+    Record the wall time, the number of calls and the peak allocations of named stages of the analysis, nested in one another.
+
+    Stages are identified by their path, the names of the stages they run in, so that the same function is reported
+    separately when it is called from different places.
+
+    Parameters:
+    - memory (bool): Whether the peak memory allocated by each stage is traced with tracemalloc, which slows Python code down
+      several times. Defaults to False.
+    """
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        # Calls, seconds and peak bytes of each path
+        self.stages = {}
+        # Path, start time, memory allocated at the start and peak so far of the running stages
+        self.stack = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        path = (self.stack[-1][0] if self.stack else ()) + (name,)
+        current = 0
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self.stack:
+                self.stack[-1][3] = max(self.stack[-1][3], peak)
+            tracemalloc.reset_peak()
+        frame = [path, time.perf_counter(), current, current]
+        self.stack.append(frame)
+        try:
+            yield
+        finally:
+            self.stack.pop()
+            elapsed = time.perf_counter() - frame[1]
+            peak = 0
+            if self.memory:
+                frame[3] = max(frame[3], tracemalloc.get_traced_memory()[1])
+                peak = frame[3] - frame[2]
+                if self.stack:
+                    self.stack[-1][3] = max(self.stack[-1][3], frame[3])
+            self.add(path, 1, elapsed, peak)
+
+    def add(self, path, calls, seconds, peak):
+        stage = self.stages.setdefault(path, [0, 0.0, 0])
+        stage[0] += calls
+        stage[1] += seconds
+        stage[2] = max(stage[2], peak)
+
+    def merge(self, stages):
+        """
+        Add the stages recorded by another profiler, for instance in a worker process, under the running stage.
+        """
+        prefix = self.stack[-1][0] if self.stack else ()
+        for path, (calls, seconds, peak) in stages.items():
+            self.add(prefix + path, calls, seconds, peak)
+
+    def summary(self):
+        """
+        Return a table of the stages, each one under the stage it runs in, with its calls, total and mean wall time,
+        share of the time of its parent and peak allocations.
+        """
+        lines = [f"{'stage':<40} {'calls':>8} {'total s':>10} {'mean ms':>10} {'parent %':>9}" + (f" {'peak MB':>9}" if self.memory else "")]
+        for path in sorted(self.stages):
+            calls, seconds, peak = self.stages[path]
+            parent = self.stages.get(path[:-1])
+            share = f"{100 * seconds / parent[1]:.1f}" if parent and parent[1] > 0 else ""
+            line = f"{'  ' * (len(path) - 1) + path[-1]:<40} {calls:>8} {seconds:>10.3f} {1000 * seconds / calls:>10.3f} {share:>9}"
+            if self.memory:
+                line += f" {peak / 2 ** 20:>9.1f}"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def folded(self):
+        """
+        Return the stages in the folded stack format read by flamegraph.pl and speedscope: one line per path with the
+        microseconds spent in the stage itself, outside of the stages it runs.
+        """
+        self_time = {path: stage[1] for path, stage in self.stages.items()}
+        for path, stage in self.stages.items():
+            if path[:-1] in self_time:
+                self_time[path[:-1]] -= stage[1]
+        return "\n".join(f"{';'.join(path)} {max(round(seconds * 1e6), 0)}" for path, seconds in sorted(self_time.items())) + "\n"
+
+# The profiler of the current process, None when profiling is off
+_PROFILER = None
+
+def enable(memory=False):
+    """
+    Start recording the stages of this process, see Profiler.
+    """
+    global _PROFILER
+    _PROFILER = Profiler(memory)
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return _PROFILER
+
+def disable():
+    """
+    Stop recording and return the profiler, or None when profiling was off.
+    """
+    global _PROFILER
+    profiler, _PROFILER = _PROFILER, None
+    if profiler is not None and profiler.memory:
+        tracemalloc.stop()
+    return profiler
+
+def active():
+    return _PROFILER
+
+def take():
+    """
+    Return the stages recorded since the last call and forget them, for a worker sending them with its results.
+    """
+    if _PROFILER is None:
+        return {}
+    stages, _PROFILER.stages = _PROFILER.stages, {}
+    return stages
+
+def stage(name):
+    """
+    Return a context manager recording its block as the stage `name`, which does nothing when profiling is off.
+    """
+    if _PROFILER is None:
+        return contextlib.nullcontext()
+    return _PROFILER.stage(name)
+
+def profiled(name=None):
+    """
+    Decorate a function so that each call is recorded as the stage `name`, the name of the function by default.
+    When profiling is off the function is called directly.
+    """
+
+    def decorate(function):
+        label = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _PROFILER is None:
+                return function(*args, **kwargs)
+            with _PROFILER.stage(label):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+@contextlib.contextmanager
+def profile(mode="time", output=None, file=sys.stderr):
+    """
+    Profile the block and print a summary when it ends.
+
+    Parameters:
+    - mode (str): 'time' records the wall time and calls of the stages, 'memory' also their peak allocations, and 'cprofile'
+      profiles every Python function with cProfile.
+    - output (str, optional): A file the profile is written to, in the folded stack format for flamegraph.pl or speedscope
+      with 'time' and 'memory', or as pstats data for snakeviz with 'cprofile'.
+    - file (file): Where the summary is printed. Defaults to standard error.
+    """
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield profiler
+        finally:
+            profiler.disable()
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(25)
+            print(stream.getvalue(), file=file)
+            if output:
+                profiler.dump_stats(output)
+        return
+
+    profiler = enable(memory=mode == "memory")
+    try:
+        yield profiler
+    finally:
+        disable()
+        print(profiler.summary(), file=file)
+        if output:
+            with open(output, "w") as f:
+                f.write(profiler.folded())
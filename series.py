@@ -0,0 +1,296 @@
+import numpy as np
+import pandas as pd
+
+def time_ns(times):
+    """
+    Convert a column of timestamps to an int64 array of nanoseconds since the epoch.
+
+    Parameters:
+    - times (pandas.Series or array-like): The timestamps to convert. Timezone-aware values are converted to UTC.
+
+    Returns:
+    - numpy.ndarray: The timestamps as int64 nanoseconds.
+    """
+    if not isinstance(times, pd.Series):
+        times = pd.Series(times)
+    if isinstance(times.dtype, pd.DatetimeTZDtype):
+        times = times.dt.tz_convert("UTC").dt.tz_localize(None)
+    return times.to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+def value_array(values):
+    """
+    Convert a column of readings to a contiguous float64 array.
+
+    Parameters:
+    - values (pandas.Series or array-like): The readings to convert.
+
+    Returns:
+    - numpy.ndarray: The readings as float64.
+    """
+    if isinstance(values, pd.Series):
+        values = values.to_numpy(dtype=np.float64)
+    return np.ascontiguousarray(values, dtype=np.float64)
+
+def sensor_codes(ids, categories=None):
+    """
+    Convert a column of sensor ids to compact int32 category codes.
+
+    Parameters:
+    - ids (pandas.Series or array-like): The sensor id of each row.
+    - categories (array-like, optional): The known sensor ids. Defaults to the ids present in `ids`, or the categories of a categorical column.
+
+    Returns:
+    - tuple: The int32 code of each row, -1 for ids that are not in `categories`, and the categories.
+    """
+    categorical = pd.Categorical(ids, categories=categories)
+    return categorical.codes.astype(np.int32), categorical.categories
+
+def segments(codes, n_codes):
+    """
+    Group rows by category code without reordering the rows of each category.
+
+    Parameters:
+    - codes (numpy.ndarray): The category code of each row, as returned by sensor_codes.
+    - n_codes (int): The number of categories.
+
+    Returns:
+    - tuple: The stable order sorting the rows by code, None when the codes are already sorted, and the n_codes + 1 offsets
+      in that order at which each code starts, the last one being the end. Rows with a code of -1 sort before the first
+      offset and belong to no segment.
+    """
+    if np.all(codes[1:] >= codes[:-1]):
+        order, ordered = None, codes
+    else:
+        order = np.argsort(codes, kind="stable")
+        ordered = codes[order]
+    starts = np.searchsorted(ordered, np.arange(n_codes + 1), side="left").astype(np.int64)
+    starts[-1] = len(codes)
+    return order, starts
+
+class CompactSeries:
+    """
+    Memory-compact readings of one or many sensors.
+
+    Timestamps are int32 seconds from an int64 nanosecond `base`, values are float32, or int16 multiples of `scale`,
+    and rows are grouped by sensor so that the sensor of a row is implied by the `starts` offsets of the segments.
+    A reading takes 6 to 8 bytes instead of the 16 of the time and value columns of a DataFrame, plus its sensor id.
+
+    Samplers, error and compute_efficiency accept a CompactSeries wherever they take a DataFrame. Each sensor is then
+    processed separately, as with `by`, and the sampled rows are returned as a CompactSeries. The samplers read the stored
+    arrays in place and error widens them a chunk at a time. Sensor views and slices share the arrays of the series.
+
+    Parameters:
+    - base (int): The time of offset 0, in nanoseconds since the epoch.
+    - offsets (numpy.ndarray): The int32 time of each row, in seconds from `base`.
+    - values (numpy.ndarray): The float32 or int16 value of each row.
+    - scale (float, optional): The value of one unit of int16 `values`. None for float values.
+    - starts (numpy.ndarray, optional): The offset of the first row of each sensor, and the number of rows. Defaults to a single sensor.
+    - categories (pandas.Index, optional): The id of each sensor. None when the readings are not grouped by sensor.
+    - tz (str, optional): The time zone of the timestamps, None for naive timestamps.
+    """
+
+    __slots__ = ("base", "offsets", "values", "scale", "starts", "categories", "tz")
+
+    def __init__(self, base, offsets, values, scale=None, starts=None, categories=None, tz=None):
+        self.base = int(base)
+        self.offsets = offsets
+        self.values = values
+        self.scale = scale
+        self.starts = np.array([0, len(offsets)], dtype=np.int64) if starts is None else starts
+        if len(self.starts) == 0 or self.starts[0] < 0 or self.starts[-1] != len(offsets):
+            raise ValueError(f"starts must run from a row of the series to its length {len(offsets)}")
+        self.categories = categories
+        self.tz = tz
+
+    @classmethod
+    def from_frame(cls, df, by=None, dtype=np.float32, scale=0.01, base=None):
+        """
+        Convert a DataFrame with 'time' and 'value' columns. Timestamps are rounded down to the second.
+
+        Parameters:
+        - df (pandas.DataFrame): The readings.
+        - by (str, optional): The column identifying the sensor of each row.
+        - dtype (numpy.dtype): The type of the stored values, float32 or int16. Defaults to float32.
+        - scale (float): The value of one unit of int16 values, 0.01 stores hundredths of a degree. Defaults to 0.01.
+        - base (int, optional): The time of offset 0 in nanoseconds. Defaults to the first second of the data.
+
+        Returns:
+        - CompactSeries: The readings, grouped by sensor with `by`, in their original order within each sensor.
+
+        Raises:
+        - ValueError: If the times span more than an int32 of seconds, or the values do not fit the int16 type.
+        """
+        return cls.from_frames([df], by, dtype, scale, base)
+
+    @classmethod
+    def from_frames(cls, frames, by=None, dtype=np.float32, scale=0.01, base=None):
+        """
+        Convert an iterable of DataFrames, such as the chunks of stream_greenhouse_data or stream_simplex,
+        without concatenating them first. See from_frame.
+        """
+        parts = []
+        known = []
+        tz = None
+        for df in frames:
+            times = time_ns(df["time"])
+            tz = getattr(df["time"].dt, "tz", None)
+            if base is None:
+                base = int(times.min()) // 10 ** 9 * 10 ** 9 if len(times) else 0
+            seconds = (times - base) // 10 ** 9
+            if len(seconds) and (seconds.min() < np.iinfo(np.int32).min or seconds.max() > np.iinfo(np.int32).max):
+                raise ValueError("The times span more than an int32 of seconds from the base.")
+            values = value_array(df["value"])
+            if np.dtype(dtype) == np.int16:
+                values = np.round(values / scale)
+                if not np.all((values >= np.iinfo(np.int16).min) & (values <= np.iinfo(np.int16).max)):
+                    raise ValueError("The values do not fit an int16 at this scale.")
+            # Sensor ids are encoded chunk by chunk, and the codes mapped to the categories of all the chunks at the end
+            codes = None
+            if by is not None:
+                codes, categories = sensor_codes(df[by])
+                used = np.bincount(codes[codes >= 0], minlength=len(categories)) > 0
+                known.append(np.asarray(categories[used]))
+                codes = (codes, categories)
+            parts.append((seconds.astype(np.int32), values.astype(dtype), codes))
+
+        scale = scale if np.dtype(dtype) == np.int16 else None
+        if by is None:
+            offsets = np.concatenate([p[0] for p in parts]) if parts else np.empty(0, dtype=np.int32)
+            values = np.concatenate([p[1] for p in parts]) if parts else np.empty(0, dtype=dtype)
+            return cls(base or 0, offsets, values, scale, tz=tz)
+
+        categories = sensor_codes(np.concatenate(known) if known else [])[1]
+        # Count the rows of each sensor, the code of -1 for missing ids first. It is mapped to itself by the last entry
+        counts = np.zeros(len(categories) + 1, dtype=np.int64)
+        for k, (part_offsets, part_values, (part_codes, part_categories)) in enumerate(parts):
+            part_codes = np.append(categories.get_indexer(part_categories), -1).astype(np.int32)[part_codes]
+            parts[k] = (part_offsets, part_values, part_codes)
+            counts += np.bincount(part_codes + 1, minlength=len(counts))
+        ends = np.cumsum(counts)
+
+        # Sort by sensor a chunk at a time: the rows of a chunk follow those of the same sensor in the previous chunks
+        offsets = np.empty(ends[-1], dtype=np.int32)
+        values = np.empty(ends[-1], dtype=dtype)
+        free = ends - counts
+        while parts:
+            part_offsets, part_values, part_codes = parts.pop(0)
+            order = np.argsort(part_codes, kind="stable")
+            part_counts = np.bincount(part_codes + 1, minlength=len(counts))
+            first = np.cumsum(part_counts) - part_counts
+            positions = np.repeat(free - first, part_counts) + np.arange(len(order))
+            offsets[positions] = part_offsets[order]
+            values[positions] = part_values[order]
+            free += part_counts
+        return cls(base or 0, offsets, values, scale, ends, categories, tz)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @property
+    def empty(self):
+        return len(self.offsets) == 0
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.values.nbytes + self.starts.nbytes
+
+    def time_ns(self):
+        """
+        Return the times as int64 nanoseconds since the epoch.
+        """
+        return self.base + self.offsets.astype(np.int64) * 10 ** 9
+
+    def value_array(self):
+        """
+        Return the values as float64.
+        """
+        if self.scale is None:
+            return self.values.astype(np.float64)
+        return self.values * np.float64(self.scale)
+
+    def hours(self):
+        """
+        Return the hour of the day of each row as int8, in the time zone of the series.
+        """
+        if self.tz is None:
+            # The seconds of the base past midnight shift the offsets, and the nanoseconds below the second never change the hour.
+            # The offsets are widened a block at a time
+            hours = np.empty(len(self.offsets), dtype=np.int8)
+            shift = np.int64(self.base // 10 ** 9 % 86400)
+            for lo in range(0, len(hours), 1 << 20):
+                hours[lo:lo + (1 << 20)] = (self.offsets[lo:lo + (1 << 20)] + shift) // 3600 % 24
+            return hours
+        return pd.DatetimeIndex(self.time_ns(), tz="UTC").tz_convert(self.tz).hour.to_numpy(dtype=np.int8)
+
+    def codes(self, categories=None):
+        """
+        Return the int32 sensor code of each row, relative to `categories` if given, -1 for the sensors not in it and for
+        the rows without a sensor id, which come before `starts[0]`.
+        """
+        codes = np.full(len(self.offsets), -1, dtype=np.int32)
+        codes[self.starts[0]:] = np.repeat(np.arange(len(self.starts) - 1, dtype=np.int32), np.diff(self.starts))
+        if categories is not None and self.categories is not None and not self.categories.equals(pd.Index(categories)):
+            # The last entry maps the code of -1 to itself
+            codes = np.append(pd.Index(categories).get_indexer(self.categories), -1).astype(np.int32)[codes]
+        return codes
+
+    def rows(self, lo, hi):
+        """
+        Return the rows from position `lo` to `hi`, keeping the sensors of the series, as a view of its arrays.
+        """
+        starts = np.clip(self.starts, lo, hi) - lo
+        return CompactSeries(self.base, self.offsets[lo:hi], self.values[lo:hi], self.scale, starts, self.categories, self.tz)
+
+    def sensor(self, sensor_id):
+        """
+        Return the readings of one sensor, as a view of the arrays of the series.
+        """
+        i = self.categories.get_loc(sensor_id)
+        lo, hi = self.starts[i], self.starts[i + 1]
+        return CompactSeries(self.base, self.offsets[lo:hi], self.values[lo:hi], self.scale, None, None, self.tz)
+
+    def take(self, indices):
+        """
+        Return the rows at sorted positions `indices`, keeping the sensors of the series.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        starts = np.searchsorted(indices, self.starts).astype(np.int64)
+        return CompactSeries(self.base, self.offsets[indices], self.values[indices], self.scale, starts, self.categories, self.tz)
+
+    def to_frame(self, by="id"):
+        """
+        Convert to a DataFrame with 'time' and 'value' columns, and a categorical `by` column when the readings are grouped by sensor.
+        """
+        time = pd.Series(self.time_ns().view("datetime64[ns]"))
+        if self.tz is not None:
+            time = time.dt.tz_localize("UTC").dt.tz_convert(self.tz)
+        df = pd.DataFrame({"time": time, "value": self.value_array()})
+        if self.categories is not None:
+            df.insert(0, by, pd.Categorical.from_codes(self.codes(), categories=self.categories))
+        return df
+
+def data_time_ns(data):
+    """
+    Return the times of a DataFrame 'time' column or of a CompactSeries as int64 nanoseconds.
+    """
+    return data.time_ns() if isinstance(data, CompactSeries) else time_ns(data["time"])
+
+def data_values(data):
+    """
+    Return the values of a DataFrame 'value' column or of a CompactSeries as float64.
+    """
+    return data.value_array() if isinstance(data, CompactSeries) else value_array(data["value"])
+
+def data_sensor_codes(data, by, categories=None):
+    """
+    Return the sensor codes and categories of a DataFrame `by` column or of a CompactSeries, see sensor_codes.
+    """
+    if isinstance(data, CompactSeries):
+        return data.codes(categories), data.categories if categories is None else categories
+    return sensor_codes(data[by], categories)
+
+def grouped(data, by):
+    """
+    Return whether the rows of a DataFrame or a CompactSeries are processed separately for each sensor.
+    """
+    return data.categories is not None if isinstance(data, CompactSeries) else by is not None
@@ -0,0 +1,179 @@
+import asyncio
+import datetime
+import math
+import time
+import aiohttp
+from dotenv import load_dotenv
+import os
+import metrics
+from implementation import RATE_OF_CHANGE, dT
+from policies import HourlyRatePolicy, LearnedRatePolicy
+from telemetry import TelemetryBatch, TelemetryQueue, Backoff, PollSchedule
+
+load_dotenv()
+
+async def poll_data(session, url):
+    with metrics.POLL_SECONDS.time(metrics.POLL_FAILURES):
+        async with session.get(url) as res:
+            return (await res.json())["temperature"]
+
+async def push_batch(session, url, readings):
+    with metrics.PUSH_SECONDS.time(metrics.PUSH_FAILURES):
+        async with session.post(url, json=readings) as res:
+            await res.read()
+            res.raise_for_status()
+    metrics.PUSHED_READINGS.inc(len(readings))
+
+async def drain(session, queue, max_rate=50, idle=1):
+    """
+    Push the batches of the queue forever, oldest first, at most `max_rate` requests per second.
+
+    Failed pushes are retried with exponential backoff, so a server coming back after an outage
+    receives the backlog at a bounded rate while the sensors keep polling. Batches rejected with
+    a client error are dropped.
+
+    Parameters:
+    - session (aiohttp.ClientSession): The session used to push.
+    - queue (TelemetryQueue): The queue of batches to push.
+    - max_rate (float): The maximum number of pushes per second. Defaults to 50.
+    - idle (float): The number of seconds to wait when the queue is empty. Defaults to 1.
+    """
+    backoff = Backoff()
+    while True:
+        batch = queue.peek()
+        if batch is None:
+            await asyncio.sleep(idle)
+            continue
+        batch_id, url, readings = batch
+        try:
+            await push_batch(session, url, readings)
+        except aiohttp.ClientResponseError as e:
+            if e.status not in (408, 429) and e.status < 500:
+                print(f"Dropped {len(readings)} readings: {e}")
+                metrics.DROPPED_READINGS.inc(len(readings))
+                queue.ack(batch_id)
+                continue
+            print(f"Push failed: {e}")
+            await asyncio.sleep(backoff.failure())
+            continue
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Push failed: {e!r}")
+            await asyncio.sleep(backoff.failure())
+            continue
+        queue.ack(batch_id)
+        backoff.success()
+        await asyncio.sleep(1 / max_rate)
+
+async def sleep_and_flush(deadline, batch, flush):
+    # Sleep until the monotonic deadline, waking up to push the batch when it gets too old
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        await asyncio.sleep(min(remaining, batch.time_to_flush()))
+        if batch.due():
+            await flush()
+
+async def run_sensor(session, queue, sensor_id, sensor_url, push_url, policy=None, batch_size=100, max_latency=60, jitter=0.05):
+    """
+    Poll one sensor forever, waiting between polls the delay returned by its polling policy.
+
+    Each delay is counted from the deadline of the previous poll, see PollSchedule, so the time spent polling and pushing
+    does not lengthen the intervals.
+
+    Readings are buffered and queued for pushing together when `batch_size` of them are waiting or the oldest one has waited `max_latency` seconds.
+    A failed poll is reported and retried with exponential backoff instead of stopping the sensor.
+
+    Parameters:
+    - session (aiohttp.ClientSession): The session whose connection pool is shared by all sensors.
+    - queue (TelemetryQueue): The queue of batches waiting to be pushed.
+    - sensor_id (str): The id of the sensor, used in the log messages.
+    - sensor_url (str): The URL returning the temperature of the sensor.
+    - push_url (str): The URL the temperature is pushed to.
+    - policy (object): The polling policy of the sensor, see policies.py. Defaults to a HourlyRatePolicy over RATE_OF_CHANGE.
+    - batch_size (int): The number of readings pushed in a single request. Defaults to 100.
+    - max_latency (float): The longest time in seconds a reading may wait before being pushed. Defaults to 60.
+    - jitter (float): The largest move of a poll around its deadline, as a fraction of the wait before it. Defaults to 0.05.
+    """
+    if policy is None:
+        policy = HourlyRatePolicy(RATE_OF_CHANGE, dT, interpolate=True)
+    batch = TelemetryBatch(batch_size, max_latency)
+    backoff = Backoff()
+    schedule = PollSchedule(jitter)
+
+    async def flush():
+        queue.put(push_url, batch.take())
+
+    deadline = None
+    while True:
+        if deadline is not None:
+            metrics.POLL_DRIFT.observe(time.monotonic() - deadline)
+        try:
+            temperature = await poll_data(session, sensor_url)
+            print(f"[{sensor_id}] New temperature: {temperature}")
+            batch.add(temperature)
+            backoff.success()
+            #calculate the wait before the next poll
+            wait_time = policy.observe(datetime.datetime.now(), temperature)
+            if math.isfinite(wait_time):
+                metrics.POLL_INTERVAL.observe(wait_time)
+        except (aiohttp.ClientError, asyncio.TimeoutError, KeyError, ValueError) as e:
+            print(f"[{sensor_id}] Poll failed: {e!r}")
+            wait_time = backoff.failure()
+        if batch.due():
+            await flush()
+        deadline = schedule.next(wait_time)
+        #wait, queuing the buffered readings when they are due
+        await sleep_and_flush(deadline, batch, flush)
+
+async def serve(sensor_ids, sensor_url, push_url, limit=100, timeout=10, batch_size=100, max_latency=60, queue_path="telemetry.db", max_rate=50,
+                make_policy=None, state_dir="rates", decay=0.0, jitter=0.05):
+    """
+    Poll many sensors on a single event loop.
+
+    All sensors share one pool of keep-alive connections, so polls and pushes to the same host reuse TCP connections.
+
+    Parameters:
+    - sensor_ids (list): The ids of the sensors.
+    - sensor_url (str): The URL of the sensor API, where '{id}' is replaced by the id of each sensor.
+    - push_url (str): The URL of the telemetry endpoint, where '{id}' is replaced by the id of each sensor.
+    - limit (int): The maximum number of simultaneous connections. Defaults to 100.
+    - timeout (float): The timeout of each request in seconds. Defaults to 10.
+    - batch_size (int): The number of readings of a sensor pushed in a single request. Defaults to 100.
+    - max_latency (float): The longest time in seconds a reading may wait before being pushed. Defaults to 60.
+    - queue_path (str): The path of the SQLite database holding the batches waiting to be pushed. Defaults to 'telemetry.db'.
+    - max_rate (float): The maximum number of pushes per second. Defaults to 50.
+    - make_policy (callable, optional): Returns a new polling policy for a sensor id, as taken by poll.sample_policy.
+      Defaults to a LearnedRatePolicy per sensor, falling back to RATE_OF_CHANGE and saved in `state_dir`.
+    - state_dir (str): The directory holding the learned rate table of each sensor. Defaults to 'rates'.
+    - decay (float): The decay of new learned rate tables, see HourlyRateEstimator. Defaults to 0.
+    - jitter (float): The largest move of a poll around its deadline, as a fraction of the wait before it. Defaults to 0.05.
+    """
+    if make_policy is None:
+        os.makedirs(state_dir, exist_ok=True)
+        make_policy = lambda sensor_id: LearnedRatePolicy(RATE_OF_CHANGE, dT, decay, path=os.path.join(state_dir, f"{sensor_id}.json"),
+                                                          interpolate=True)
+    queue = TelemetryQueue(queue_path)
+    connector = aiohttp.TCPConnector(limit=limit)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        await asyncio.gather(drain(session, queue, max_rate), *(
+            run_sensor(session, queue, sensor_id, sensor_url.format(id=sensor_id), push_url.format(id=sensor_id),
+                       make_policy(sensor_id), batch_size, max_latency, jitter)
+            for sensor_id in sensor_ids
+        ))
+
+def main():
+    metrics.configure()
+    sensor_ids = os.getenv("SENSOR_IDS").split(",")
+    batch_size = int(os.getenv("PUSH_BATCH_SIZE", 100))
+    max_latency = float(os.getenv("PUSH_MAX_LATENCY", 60))
+    queue_path = os.getenv("QUEUE_PATH", "telemetry.db")
+    max_rate = float(os.getenv("PUSH_MAX_RATE", 50))
+    state_dir = os.getenv("RATE_STATE_DIR", "rates")
+    decay = float(os.getenv("RATE_DECAY", 0))
+    jitter = float(os.getenv("POLL_JITTER", 0.05))
+    asyncio.run(serve(sensor_ids, os.getenv("SENSOR_API_URL"), os.getenv("API_URL"), batch_size=batch_size, max_latency=max_latency,
+                      queue_path=queue_path, max_rate=max_rate, state_dir=state_dir, decay=decay, jitter=jitter))
+
+if __name__ == "__main__":
+    main()
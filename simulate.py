@@ -0,0 +1,186 @@
+import array
+import bisect
+import datetime
+import json
+import math
+import numpy as np
+import pandas as pd
+from series import CompactSeries, segments, time_ns, value_array, data_sensor_codes, grouped
+from stats import ErrorStats
+
+# Approximate size in bytes of the request line and headers of an HTTP request and of its response
+HTTP_OVERHEAD = 400
+
+EPOCH = datetime.datetime(1970, 1, 1)
+UTC_EPOCH = EPOCH.replace(tzinfo=datetime.timezone.utc)
+
+def _doubles(a):
+    # An array of doubles takes 8 bytes per item like a numpy array, but its items are read much faster from Python
+    doubles = array.array("d")
+    doubles.frombytes(memoryview(np.ascontiguousarray(a, dtype=np.float64)).cast("B"))
+    return doubles
+
+def _longs(a):
+    # The same for int64 nanoseconds, which Python reads as exact integers
+    longs = array.array("q")
+    longs.frombytes(memoryview(np.ascontiguousarray(a, dtype=np.int64)).cast("B"))
+    return longs
+
+# Size of the JSON body of a poll response and of a reading pushed to ThingsBoard, without the digits of their numbers.
+# A pushed reading is also followed by the comma separating it from the next one.
+POLL_BYTES = len(json.dumps({"temperature": 0})) - 1
+READING_BYTES = len(json.dumps({"ts": 0, "values": {"temperature": 0}}) + ", ") - 2
+
+# An integer written in decimal has one digit more than the number of these it is at least, and a minus sign when negative
+POWERS_OF_TEN = 10 ** np.arange(1, 19, dtype=np.int64)
+
+def _poll_sensor(keys, values, policy, tz):
+    # Poll one sensor from the start of its trace, returning the times in nanoseconds and the readings of its polls.
+    # The clock is kept in integer nanoseconds, as by poll.sample_policy, so that a poll landing on a point of the trace
+    # reads it exactly; it only goes through floats to interpolate. This loop runs once per poll, the functions it calls
+    # are bound to locals
+    polled_times = array.array("q")
+    polled_values = array.array("d")
+    add_time, add_value = polled_times.append, polled_values.append
+    bisect_right, timedelta, isfinite, observe = bisect.bisect_right, datetime.timedelta, math.isfinite, policy.observe
+    epoch = EPOCH if tz is None else UTC_EPOCH
+    now, end, hi = keys[0], keys[-1], len(keys)
+    i = 0
+    while True:
+        # Interpolate the reading at the poll time from the trace, moving the cursor forward
+        i = bisect_right(keys, now, i, hi) - 1
+        if i + 1 < hi and keys[i + 1] > keys[i]:
+            value = values[i] + (values[i + 1] - values[i]) * ((now - keys[i]) / (keys[i + 1] - keys[i]))
+        else:
+            value = values[i]
+        add_time(now)
+        add_value(value)
+
+        time = epoch + timedelta(microseconds=now // 1000)
+        if tz is not None:
+            time = time.astimezone(tz)
+        delay = observe(time, value)
+        if not isfinite(delay):
+            return polled_times, polled_values
+        # Add the delay rounded to the microsecond, the resolution of the datetimes the policies receive
+        now += round(delay * 1e6) * 1000
+        if now > end:
+            return polled_times, polled_values
+
+def _count_pushes(polled_times, batch_size, max_latency):
+    # A batch opened by a reading is pushed with the readings polled until max_latency later, a reading polled at the
+    # time of the push included, or as soon as it holds batch_size readings. The reading opening the next batch is
+    # found for every reading at once, and the batches are then chained from the first reading
+    times = np.frombuffer(polled_times, dtype=np.int64)
+    n = len(times)
+    latency = int(round(max_latency * 1e9))
+    following = np.minimum(np.searchsorted(times, times + latency, side="right"), np.arange(n) + batch_size).tolist()
+    pushes = i = 0
+    while i < n:
+        i = following[i]
+        pushes += 1
+    return pushes
+
+def simulate(df, make_policy, by=None, batch_size=100, max_latency=60, http_overhead=HTTP_OVERHEAD, keep_polled=True):
+    """
+    Replay traces through online polling policies on a virtual clock, as the live poller would run them.
+
+    Each sensor is polled at the start of its trace. The policy receives the reading and returns the delay before the
+    next poll, which is taken at once on the clock of the sensor, so nothing sleeps. Sensors share nothing, so they are
+    replayed one after the other and only the trace of the current one is widened to doubles. A reading at an arbitrary
+    time is interpolated linearly between the two points of the trace around it. Readings are buffered and pushed in
+    batches as by TelemetryBatch: when `batch_size` readings are waiting, or when the oldest has waited `max_latency`
+    seconds. A sensor stops being polled at the end of its trace, or when its policy returns a delay that is not finite.
+
+    Parameters:
+    - df (pandas.DataFrame or CompactSeries): The traces, with 'time' and 'value' columns, sorted by time for each sensor.
+    - make_policy (callable): Returns a new policy for a sensor id, None without `by`, as taken by poll.sample_policy.
+    - by (str, optional): The column identifying the sensor of each row. When given, each sensor is simulated with its own policy.
+    - batch_size (int): The number of readings pushed in a single request. Defaults to 100.
+    - max_latency (float): The longest time in seconds a reading waits before being pushed. Defaults to 60.
+    - http_overhead (int): The bytes of the headers of a request and of its response. Defaults to HTTP_OVERHEAD.
+    - keep_polled (bool): Whether the polled readings are returned. Without them, the memory used beyond `df` is that of
+      the trace of a single sensor. Defaults to True.
+
+    Returns:
+    - dict: The simulation results:
+      - 'polls' (int): The number of polls.
+      - 'pushes' (int): The number of push requests.
+      - 'bytes' (int): The bytes sent and received by the polls and the pushes.
+      - 'error' (ErrorStats): The error of the readings reconstructed from the polls, compared as by analyze.error.
+      - 'polled' (pandas.DataFrame): The 'time' and 'value' of each poll, and the `by` column with `by`. None without `keep_polled`.
+    """
+    per_sensor = grouped(df, by)
+    if isinstance(df, CompactSeries):
+        starts, sensors, tz = df.starts, df.categories if per_sensor else [None], df.tz
+    else:
+        tz = getattr(df["time"].dt, "tz", None)
+        if per_sensor:
+            codes, sensors = data_sensor_codes(df, by)
+            order, starts = segments(codes, len(sensors))
+        else:
+            sensors, order, starts = [None], None, np.array([0, len(df)], dtype=np.int64)
+        # The columns of a DataFrame are already wide, they are only reordered when its sensors are interleaved
+        times, values = time_ns(df["time"]), value_array(df["value"])
+        if order is not None:
+            times, values = times[order], values[order]
+    starts = starts.tolist()
+
+    stats = ErrorStats()
+    polls = pushes = traffic = 0
+    kept_times, kept_values = [], []
+    for s, sensor in enumerate(sensors):
+        lo, hi = starts[s], starts[s + 1]
+        if isinstance(df, CompactSeries):
+            trace = df.rows(lo, hi)
+            keys, trace_values = trace.time_ns(), trace.value_array()
+        else:
+            keys, trace_values = times[lo:hi], values[lo:hi]
+        if not len(keys):
+            if keep_polled:
+                kept_times.append(np.empty(0, dtype=np.int64))
+                kept_values.append(np.empty(0))
+            continue
+
+        polled_times, polled_values = _poll_sensor(_longs(keys), _doubles(trace_values), make_policy(sensor), tz)
+        polled_ns = np.frombuffer(polled_times, dtype=np.int64)
+        polled = np.frombuffer(polled_values)
+
+        # Each reading is polled and pushed once. json.dumps writes floats with repr, counting the digits is much
+        # faster than encoding, and a pushed reading carries its timestamp in milliseconds
+        count = len(polled_times)
+        digits = sum(map(len, map(repr, polled_values)))
+        milliseconds = polled_ns // 10 ** 6
+        timestamps = int((1 + np.searchsorted(POWERS_OF_TEN, np.abs(milliseconds), side="right") + (milliseconds < 0)).sum())
+        sensor_pushes = _count_pushes(polled_times, batch_size, max_latency)
+        polls += count
+        pushes += sensor_pushes
+        traffic += count * (http_overhead + POLL_BYTES + READING_BYTES) + 2 * digits + timestamps + sensor_pushes * http_overhead
+
+        # Compare every point of the trace but the first with the last poll at or before it, as error does
+        positions = np.searchsorted(polled_ns, keys[1:], side="right") - 1
+        found = positions >= 0
+        stats.update(np.abs(trace_values[1:][found] - polled[positions[found]]))
+        if keep_polled:
+            kept_times.append(polled_ns)
+            kept_values.append(polled)
+
+    polled = None
+    if keep_polled:
+        polled = pd.DataFrame({
+            "time": pd.to_datetime(np.concatenate(kept_times) if kept_times else np.empty(0, dtype=np.int64)),
+            "value": np.concatenate(kept_values) if kept_values else np.empty(0),
+        })
+        if tz is not None:
+            polled["time"] = polled["time"].dt.tz_localize("UTC").dt.tz_convert(tz)
+        if per_sensor:
+            codes = np.repeat(np.arange(len(sensors)), [len(t) for t in kept_times])
+            polled.insert(0, by or "id", pd.Categorical.from_codes(codes, categories=sensors))
+
+    return {
+        "polls": polls,
+        "pushes": pushes,
+        "bytes": traffic,
+        "error": stats,
+        "polled": polled,
+    }
@@ -0,0 +1,119 @@
+import math
+import numpy as np
+
+class ErrorStats:
+    """
+    Streaming statistics of errors: count, mean, variance, max and approximate quantiles, computed in one pass
+    over chunks of errors in constant memory.
+
+    The mean and variance of each chunk are merged into the running ones with the pairwise formulas of Chan et al.
+    Quantiles come from a merging t-digest: the errors are summarized by about `compression` / 2 weighted centroids,
+    small near the extremes so that tail quantiles such as p99 stay accurate.
+
+    Parameters:
+    - compression (float): The t-digest compression. Higher values keep more centroids and give more accurate quantiles. Defaults to 1000.
+    """
+
+    def __init__(self, compression=1000):
+        self.compression = compression
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.centroids = np.empty(0)
+        self.weights = np.empty(0)
+
+    def update(self, values):
+        """
+        Add a chunk of errors.
+
+        Parameters:
+        - values (array-like): The errors of the chunk.
+
+        Returns:
+        - ErrorStats: self, so that updates can be chained.
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if len(values) == 0:
+            return self
+        mean = float(values.mean())
+        self._combine(len(values), mean, float(np.square(values - mean).sum()), values.min(), values.max())
+        self._compress(np.sort(values), np.ones(len(values)))
+        return self
+
+    def merge(self, other):
+        """
+        Add the errors summarized by another ErrorStats, for instance one computed in another process.
+
+        Returns:
+        - ErrorStats: self.
+        """
+        if other.count:
+            self._combine(other.count, other.mean, other.m2, other.min, other.max)
+            self._compress(other.centroids, other.weights)
+        return self
+
+    def _combine(self, count, mean, m2, minimum, maximum):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+        self.min = min(self.min, float(minimum))
+        self.max = max(self.max, float(maximum))
+
+    def _compress(self, centroids, weights):
+        # Both the new centroids and the current ones are sorted, insert the few current ones rather than sorting again
+        positions = np.searchsorted(centroids, self.centroids)
+        centroids = np.insert(centroids, positions, self.centroids)
+        weights = np.insert(weights, positions, self.weights)
+        # Centroids whose left quantile falls in the same unit of the scale function k(q) = compression / 2π * asin(2q - 1)
+        # are merged, so each one covers a range of quantiles that shrinks near 0 and 1
+        left = (np.cumsum(weights) - weights) / weights.sum()
+        k = np.floor(self.compression / (2 * math.pi) * np.arcsin(2 * left - 1))
+        starts = np.flatnonzero(np.concatenate([[True], k[1:] != k[:-1]]))
+        self.weights = np.add.reduceat(weights, starts)
+        self.centroids = np.add.reduceat(centroids * weights, starts) / self.weights
+
+    @property
+    def variance(self):
+        """
+        The population variance of the errors, NaN when there are none.
+        """
+        return self.m2 / self.count if self.count else math.nan
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def quantile(self, q):
+        """
+        Return the approximate q-quantile of the errors, NaN when there are none.
+
+        Parameters:
+        - q (float or array-like): The quantile, between 0 and 1.
+        """
+        if not self.count:
+            return math.nan if np.ndim(q) == 0 else np.full(np.shape(q), math.nan)
+        # Interpolate between the centers of the centroids, the minimum and the maximum
+        centers = np.cumsum(self.weights) - self.weights / 2
+        ranks = np.concatenate([[0], centers, [self.count]])
+        values = np.concatenate([[self.min], self.centroids, [self.max]])
+        result = np.interp(np.asarray(q) * self.count, ranks, values)
+        return float(result) if np.ndim(result) == 0 else result
+
+    def summary(self):
+        """
+        Return the statistics as a dict with the 'count', 'mean', 'std', 'max', 'p50', 'p95' and 'p99' keys.
+        """
+        p50, p95, p99 = self.quantile([0.5, 0.95, 0.99]).tolist() if self.count else [math.nan] * 3
+        return {
+            "count": self.count,
+            "mean": self.mean if self.count else math.nan,
+            "std": self.std,
+            "max": self.max if self.count else math.nan,
+            "p50": p50,
+            "p95": p95,
+            "p99": p99,
+        }
@@ -0,0 +1,330 @@
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+import profiling
+from analyze import error_stats, compute_efficiency
+from poll import sample_every_kth_point, sample_reglin, optimal_sample, sample_avg_rate_of_change, sample_policy
+from policies import RegLinPolicy, HourlyRatePolicy
+from memo import ResultCache, fingerprint
+from series import time_ns, value_array, sensor_codes
+
+STRATEGIES = {
+    "every_kth_point": lambda df, x, hroc, by: sample_every_kth_point(df, int(x), by=by),
+    "reglin": lambda df, x, hroc, by: sample_reglin(df, max_dT=x, by=by),
+    "optimal": lambda df, x, hroc, by: optimal_sample(df, threshold_dT=x, by=by),
+    "avg_rate_of_change": lambda df, x, hroc, by: sample_avg_rate_of_change(df, 3600 * x / hroc, by=by),
+    # The policies run by the live poller
+    "reglin_policy": lambda df, x, hroc, by: sample_policy(df, lambda sensor: RegLinPolicy(max_dT=x), by),
+    "hourly_rate_policy": lambda df, x, hroc, by: sample_policy(
+        df, lambda sensor: HourlyRatePolicy(hroc if by is None else hroc.loc[sensor], x, interpolate=True), by),
+}
+
+# Types of the time, value and sensor code arrays shared with the workers
+_DTYPES = (np.int64, np.float64, np.int32)
+
+def _context():
+    # Workers are forked from a server process rather than from the caller, which may have started threads
+    # (the parallel kernels of opensimplex do) that a forked child cannot use. There is no fork server on Windows,
+    # where workers are spawned.
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["sweep"])
+    return context
+
+# Results of the sweeps of this session, reused when the same strategy, parameter and data are evaluated again
+RESULTS = ResultCache()
+
+# Source series of the current worker, rebuilt once from shared memory by _attach
+_worker = {}
+
+def _rebuild(times, values, codes, tz, by, categories):
+    time = pd.Series(times.view("datetime64[ns]"))
+    if tz is not None:
+        time = time.dt.tz_localize("UTC").dt.tz_convert(tz)
+    df = pd.DataFrame({"time": time, "value": values})
+    if by is not None:
+        df[by] = pd.Categorical.from_codes(codes, categories=categories)
+    return df
+
+def _attach(names, length, tz, hroc, by, categories, memory):
+    # memory is None unless the caller is profiled, see profiling.Profiler
+    if memory is not None:
+        profiling.enable(memory)
+    blocks = [shared_memory.SharedMemory(name=name) for name in names]
+    arrays = [np.ndarray(length, dtype=dtype, buffer=block.buf) for block, dtype in zip(blocks, _DTYPES)]
+    _worker["blocks"] = blocks
+    _worker["df"] = _rebuild(*arrays, tz, by, categories)
+    _worker["hroc"] = hroc
+    _worker["by"] = by
+
+@profiling.profiled("evaluate")
+def _evaluate(task):
+    strategy, x = task
+    df = _worker["df"]
+    by = _worker["by"]
+    df_sampled = STRATEGIES[strategy](df, x, _worker["hroc"], by)
+    stats = error_stats(df_sampled, df, 'value', by)
+    efficiency = compute_efficiency(df_sampled, by)
+    return {
+        "strategy": strategy,
+        "parameter": x,
+        "mean": stats.mean if stats.count else np.nan,
+        "median": stats.quantile(0.5),
+        "std": stats.std,
+        "max": stats.max if stats.count else np.nan,
+        "p95": stats.quantile(0.95),
+        "p99": stats.quantile(0.99),
+        "efficiency": efficiency if by is None else efficiency.mean(),
+    }
+
+def _evaluate_profiled(task):
+    # Send the stages recorded by the worker with the result of the task
+    return _evaluate(task), profiling.take()
+
+def _evaluate_all(df, tasks, hroc, processes, by):
+    tz = getattr(df["time"].dt, "tz", None)
+    codes, categories = sensor_codes(df[by]) if by is not None else (np.zeros(len(df), dtype=np.int32), None)
+    arrays = [time_ns(df["time"]), value_array(df["value"]), codes]
+
+    if processes == 1:
+        _worker["df"] = _rebuild(*arrays, tz, by, categories)
+        _worker["hroc"] = hroc
+        _worker["by"] = by
+        try:
+            return [_evaluate(task) for task in tasks]
+        finally:
+            _worker.clear()
+
+    blocks = []
+    try:
+        for array in arrays:
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+            blocks.append(block)
+        names = [block.name for block in blocks]
+        profiler = profiling.active()
+        memory = profiler.memory if profiler is not None else None
+        with _context().Pool(processes, initializer=_attach, initargs=(names, len(df), tz, hroc, by, categories, memory)) as pool:
+            if profiler is None:
+                return pool.map(_evaluate, tasks, chunksize=1)
+            results = pool.map(_evaluate_profiled, tasks, chunksize=1)
+        for _, stages in results:
+            profiler.merge(stages)
+        return [result for result, _ in results]
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+# Strategies that read the hourly rate of change, whose results depend on it
+HROC_STRATEGIES = {"avg_rate_of_change", "hourly_rate_policy"}
+
+def _key(cache, data, hroc, by, kind, strategy, x):
+    hroc = fingerprint(hroc) if strategy in HROC_STRATEGIES and hroc is not None else None
+    return cache.key(data, hroc, by, kind, strategy, x)
+
+@profiling.profiled()
+def run_sweep(df, tasks, hroc=None, processes=None, by=None, cache=None):
+    """
+    Evaluate sampling strategies over a set of parameter values in a process pool.
+
+    The time, value and sensor columns of `df` are copied once into shared memory and every worker
+    maps them instead of receiving a pickled DataFrame with each task.
+
+    Parameters:
+    - df (pandas.DataFrame): The input DataFrame containing the 'time' and 'value' columns.
+    - tasks (iterable): (strategy, parameter) pairs, where strategy is a key of STRATEGIES.
+    - hroc (pandas.Series, optional): The hourly rate of change, required by the "avg_rate_of_change" and "hourly_rate_policy" strategies.
+    - processes (int, optional): The number of worker processes. Defaults to the number of cores, 1 runs in the current process.
+    - by (str, optional): The column identifying the sensor of each row. When given, sensors are sampled separately,
+      `hroc` may hold one row per sensor and the efficiency is averaged over the sensors.
+    - cache (ResultCache, optional): The results already evaluated, keyed by the content of `df` and `hroc`, the strategy
+      and the parameter. Only the missing tasks are evaluated. Defaults to RESULTS, False disables it.
+
+    Returns:
+    - pandas.DataFrame: One row per task with the 'strategy', 'parameter', 'mean', 'median', 'std', 'max', 'p95', 'p99' and
+      'efficiency' columns. The error statistics are computed in a single pass by error_stats, the quantiles are approximate.
+
+    Raises:
+    - ValueError: If a strategy is unknown.
+    """
+    tasks = list(tasks)
+    for strategy, _ in tasks:
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown strategy '{strategy}'.")
+
+    if cache is False:
+        return pd.DataFrame(_evaluate_all(df, tasks, hroc, processes, by))
+    if cache is None:
+        cache = RESULTS
+
+    data = fingerprint(df, by)
+    keys = [_key(cache, data, hroc, by, "evaluate", strategy, x) for strategy, x in tasks]
+    results = [cache.get(key) for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        evaluated = _evaluate_all(df, [tasks[i] for i in missing], hroc, processes, by)
+        for i, result in zip(missing, evaluated):
+            cache.put(keys[i], result)
+            results[i] = result
+    # The cached parameter may be an equal value of another type
+    return pd.DataFrame([dict(result, parameter=x) for result, (_, x) in zip(results, tasks)])
+
+@profiling.profiled()
+def sample(df, strategy, x, hroc=None, by=None, cache=None):
+    """
+    Sample `df` with a strategy of STRATEGIES, reusing the sampled DataFrame when the same data was already sampled.
+
+    Parameters:
+    - df, hroc, by, cache: See run_sweep.
+    - strategy (str): The strategy, a key of STRATEGIES.
+    - x (float): The parameter of the strategy.
+
+    Returns:
+    - pandas.DataFrame: The sampled rows of `df`.
+
+    Raises:
+    - ValueError: If the strategy is unknown.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown strategy '{strategy}'.")
+    if cache is False:
+        return STRATEGIES[strategy](df, x, hroc, by)
+    if cache is None:
+        cache = RESULTS
+
+    key = _key(cache, fingerprint(df, by, index=True), hroc, by, "sample", strategy, x)
+    df_sampled = cache.get(key)
+    if df_sampled is None:
+        df_sampled = STRATEGIES[strategy](df, x, hroc, by)
+        cache.put(key, df_sampled)
+    return df_sampled
+
+# Strategies whose parameter is an integer
+INTEGER_STRATEGIES = {"every_kth_point"}
+
+def _grid(strategy, low, high, count):
+    grid = np.linspace(low, high, count)
+    if strategy in INTEGER_STRATEGIES:
+        grid = np.unique(np.round(grid))
+    return grid.tolist()
+
+@profiling.profiled()
+def refine_sweep(df, ranges, hroc=None, processes=None, by=None, initial=4, tolerance=0.1, resolution=1 / 32,
+                 max_evaluations=30, window=(1.3, 8000)):
+    """
+    Trace the error versus polling interval frontier of strategies, refining the parameter only where the frontier changes.
+
+    Each strategy starts from `initial` evenly spaced parameter values, then from `initial` more spread evenly over the part
+    of the range whose points fall inside the plotted `window`. At each round, the interval between two neighbouring
+    values is split in half when their (mean error, efficiency) points are further apart than `tolerance`, measured in
+    fractions of the window. Intervals with both ends outside the window, or narrower than `resolution`, are never split,
+    so that the noise of the error between close parameters is not chased. All the strategies of a round are evaluated
+    in a single run_sweep.
+
+    On a Simplex trace of 3000 points and the ranges of main.SWEEPS, this evaluates about 55 parameters instead of
+    the 179 of the grids, leaving gaps in the window as wide as those of the grids.
+
+    Parameters:
+    - df (pandas.DataFrame): The input DataFrame containing the data.
+    - ranges (dict): The (low, high) range of the parameter of each strategy.
+    - hroc, processes, by: See run_sweep.
+    - initial (int): The number of starting values of each strategy. Defaults to 4.
+    - tolerance (float): The largest gap left between neighbouring points of the frontier. Defaults to 0.1.
+    - resolution (float): The narrowest interval split, as a fraction of the range of the parameter. Defaults to 1/32.
+    - max_evaluations (int): The budget of evaluations of each strategy, which stops the splits of a noisy frontier before
+      the tolerance is met. Defaults to 30.
+    - window (tuple): The largest mean error and efficiency of interest. Defaults to (1.3, 8000).
+
+    Returns:
+    - pandas.DataFrame: The evaluated points, as returned by run_sweep, sorted by strategy and parameter.
+    """
+    def outside(point):
+        return point.mean > window[0] or point.efficiency > window[1]
+
+    tasks = [(strategy, x) for strategy, (low, high) in ranges.items() for x in _grid(strategy, low, high, initial)]
+    results = run_sweep(df, tasks, hroc, processes, by)
+
+    # Seed again evenly between the neighbours of the first and the last points inside the window
+    tasks = []
+    for strategy, group in results.groupby("strategy", sort=False):
+        group = group.sort_values("parameter", ignore_index=True)
+        inside = [i for i, point in enumerate(group.itertuples()) if not outside(point)]
+        if not inside:
+            continue
+        low = group["parameter"].iloc[max(inside[0] - 1, 0)]
+        high = group["parameter"].iloc[min(inside[-1] + 1, len(group) - 1)]
+        evaluated = set(group["parameter"])
+        tasks += [(strategy, x) for x in _grid(strategy, low, high, initial + 2)[1:-1] if x not in evaluated]
+    if tasks:
+        results = pd.concat([results, run_sweep(df, tasks, hroc, processes, by)], ignore_index=True)
+
+    while True:
+        tasks = []
+        for strategy, group in results.groupby("strategy", sort=False):
+            budget = max_evaluations - len(group)
+            low, high = ranges[strategy]
+            narrowest = (high - low) * resolution
+            group = group.sort_values("parameter")
+            splits = []
+            for a, b in zip(group.iloc[:-1].itertuples(), group.iloc[1:].itertuples()):
+                if outside(a) and outside(b):
+                    continue
+                gap = np.hypot((b.mean - a.mean) / window[0], (b.efficiency - a.efficiency) / window[1])
+                middle = (a.parameter + b.parameter) / 2
+                if strategy in INTEGER_STRATEGIES:
+                    middle = float(np.floor(middle))
+                if gap > tolerance and b.parameter - a.parameter > narrowest and a.parameter < middle < b.parameter:
+                    splits.append((gap, middle))
+            # Split the largest gaps first when the budget runs out
+            splits.sort(reverse=True)
+            tasks += [(strategy, middle) for _, middle in splits[:max(budget, 0)]]
+        if not tasks:
+            break
+        results = pd.concat([results, run_sweep(df, tasks, hroc, processes, by)], ignore_index=True)
+
+    return results.sort_values(["strategy", "parameter"], kind="stable", ignore_index=True)
+
+def cheapest_parameter(df, strategy, max_error, low, high, hroc=None, processes=None, by=None, points=4, rounds=5):
+    """
+    Find the parameter of a strategy that polls least often while keeping the mean error at most `max_error`.
+
+    The error is assumed to grow with the parameter, so the search narrows the bracket between the last parameter meeting
+    the target and the first one missing it, evaluating `points` values per round in a single run_sweep.
+
+    Parameters:
+    - df (pandas.DataFrame): The input DataFrame containing the data.
+    - strategy (str): The strategy, a key of STRATEGIES.
+    - max_error (float): The largest acceptable mean error.
+    - low, high (float): The range of the parameter.
+    - hroc, processes, by: See run_sweep.
+    - points (int): The number of values evaluated per round. Defaults to 4.
+    - rounds (int): The number of rounds. Defaults to 5.
+
+    Returns:
+    - pandas.Series: The evaluated point meeting the target with the largest efficiency, as a row of run_sweep,
+      or None if no evaluated parameter meets it.
+    """
+    grid = _grid(strategy, low, high, points)
+    results = run_sweep(df, [(strategy, x) for x in grid], hroc, processes, by)
+
+    for _ in range(rounds - 1):
+        ordered = results.sort_values("parameter")
+        ok = ordered[ordered["mean"] <= max_error]
+        if ok.empty:
+            break
+        above = ordered[ordered["parameter"] > ok["parameter"].max()]
+        if above.empty:
+            break
+        lo, hi = ok["parameter"].max(), above["parameter"].min()
+        grid = [x for x in _grid(strategy, lo, hi, points + 2)[1:-1] if lo < x < hi and x not in set(results["parameter"])]
+        if not grid:
+            break
+        results = pd.concat([results, run_sweep(df, [(strategy, x) for x in grid], hroc, processes, by)], ignore_index=True)
+
+    ok = results[results["mean"] <= max_error]
+    if ok.empty:
+        return None
+    return ok.loc[ok["efficiency"].idxmax()]
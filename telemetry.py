@@ -0,0 +1,170 @@
+import json
+import math
+import random
+import sqlite3
+import threading
+import time
+
+class TelemetryBatch:
+    """
+    Buffer timestamped readings and decide when to push them to ThingsBoard in a single request.
+
+    The batch is due when it holds `max_size` readings, or when its oldest reading has waited `max_latency` seconds.
+
+    Parameters:
+    - max_size (int): The number of readings that triggers a push. Defaults to 100.
+    - max_latency (float): The longest time in seconds a reading may wait before being pushed. Defaults to 60.
+    """
+
+    def __init__(self, max_size=100, max_latency=60):
+        self.max_size = max_size
+        self.max_latency = max_latency
+        self.readings = []
+        self.oldest = None
+
+    def __len__(self):
+        return len(self.readings)
+
+    def add(self, temperature, ts=None):
+        """
+        Add a reading, timestamped now unless `ts` (milliseconds since the epoch) is given.
+        """
+        if ts is None:
+            ts = int(time.time() * 1000)
+        if not self.readings:
+            self.oldest = time.monotonic()
+        self.readings.append({"ts": ts, "values": {"temperature": temperature}})
+
+    def time_to_flush(self):
+        """
+        Return the number of seconds before the batch is due because of its age, infinity when it is empty.
+        """
+        if not self.readings:
+            return math.inf
+        if len(self.readings) >= self.max_size:
+            return 0
+        return max(self.oldest + self.max_latency - time.monotonic(), 0)
+
+    def due(self):
+        return self.time_to_flush() == 0
+
+    def take(self):
+        """
+        Empty the batch and return its readings, in the array format accepted by the ThingsBoard telemetry API.
+        """
+        readings = self.readings
+        self.readings = []
+        self.oldest = None
+        return readings
+
+class TelemetryQueue:
+    """
+    Durable FIFO of telemetry batches waiting to be pushed, stored in a SQLite database in WAL mode.
+
+    Polling appends batches and a separate drainer pushes them, so readings survive a server outage or a restart
+    without being held in memory. When more than `max_batches` batches are waiting, the oldest ones are dropped.
+
+    Parameters:
+    - path (str): The path of the SQLite database.
+    - max_batches (int): The maximum number of batches kept. Defaults to 100000.
+    """
+
+    def __init__(self, path, max_batches=100000):
+        self.path = path
+        self.max_batches = max_batches
+        self._local = threading.local()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS batches (id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL, readings TEXT NOT NULL)"
+        )
+
+    def _connection(self):
+        # SQLite connections cannot be shared between threads, each thread opens its own
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM batches").fetchone()[0]
+
+    def put(self, url, readings):
+        """
+        Append a batch of readings to push to `url`.
+        """
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN")
+            rowid = connection.execute("INSERT INTO batches (url, readings) VALUES (?, ?)", (url, json.dumps(readings))).lastrowid
+            # Ids are contiguous since batches are only removed from the head
+            connection.execute("DELETE FROM batches WHERE id <= ?", (rowid - self.max_batches,))
+
+    def peek(self):
+        """
+        Return the oldest batch as an (id, url, readings) tuple, or None when the queue is empty.
+        """
+        row = self._connection().execute("SELECT id, url, readings FROM batches ORDER BY id LIMIT 1").fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    def ack(self, batch_id):
+        """
+        Remove a batch once it has been pushed.
+        """
+        self._connection().execute("DELETE FROM batches WHERE id = ?", (batch_id,))
+
+class Backoff:
+    """
+    Exponential backoff with full jitter for retrying pushes.
+
+    Parameters:
+    - initial (float): The longest delay in seconds after the first failure. Defaults to 1.
+    - maximum (float): The cap on the delay in seconds. Defaults to 300.
+    """
+
+    def __init__(self, initial=1, maximum=300):
+        self.initial = initial
+        self.maximum = maximum
+        self.failures = 0
+
+    def failure(self):
+        """
+        Record a failure and return the number of seconds to wait before retrying.
+        """
+        delay = min(self.initial * 2 ** min(self.failures, 32), self.maximum)
+        self.failures += 1
+        return random.uniform(0, delay)
+
+    def success(self):
+        self.failures = 0
+
+class PollSchedule:
+    """
+    Deadlines of the polls of a sensor on the monotonic clock.
+
+    Each deadline is the previous one plus the wait returned by the polling policy, rather than the end of the previous
+    poll plus the wait, so the time spent polling and pushing does not add up and the cadence stays on target.
+    A deadline that has already passed, after a long outage or a suspended machine, is moved to now rather than
+    followed by a burst of polls catching up. With a jitter, each poll is moved by a random fraction of its wait
+    around its deadline, without moving the following ones, so that sensors started together do not poll in bursts.
+
+    Parameters:
+    - jitter (float): The largest move of a poll, as a fraction of the wait before it. Defaults to 0.
+    """
+
+    def __init__(self, jitter=0.0):
+        self.jitter = jitter
+        self.deadline = time.monotonic()
+
+    def next(self, wait):
+        """
+        Schedule the next poll `wait` seconds after the deadline of the previous one, and return its monotonic time.
+        """
+        now = time.monotonic()
+        self.deadline = max(self.deadline + wait, now)
+        if self.jitter:
+            return max(self.deadline + random.uniform(-self.jitter, self.jitter) * wait, now)
+        return self.deadline